@@ -0,0 +1,124 @@
+"""Key dispatch, click-to-open and input throughput"""
+
+import os
+import time
+import tempfile
+
+from harness import Gdk, iterate, measure, summarize, show, BenchPlugin, make_key_event, make_button_event
+
+KEY_PRESSES = 10000
+FEED_SIZE = 4 * 1024 * 1024
+
+
+def bench_key_dispatch(repeat):
+    """Cost of on_vte_key_press per key, for plain typing and for a key with modifiers"""
+
+    from terminalenhanced.widgets import GeditTerminalEnhancedPanel
+
+    panel = GeditTerminalEnhancedPanel(BenchPlugin())
+    window = show(panel)
+    term = panel.ensure_terminal()
+    iterate()
+
+    # there's no application here, so no other accelerators
+    panel.accel_table = {}
+
+    events = {
+        'plain': make_key_event(term.get_window(), Gdk.KEY_a),
+        'control': make_key_event(term.get_window(), Gdk.KEY_j, Gdk.ModifierType.CONTROL_MASK),
+    }
+
+    result = {}
+
+    for name, event in events.items():
+        durations = measure(lambda: [panel.on_vte_key_press(term, event.key) for i in range(KEY_PRESSES)], repeat)
+        result[name + '-us-per-key'] = summarize([duration * 1000 / KEY_PRESSES for duration in durations])
+
+    window.destroy()
+    return result
+
+
+def bench_click_to_open(repeat):
+    """From Ctrl+Click on a file:line:column reference until the file would be opened"""
+
+    from terminalenhanced.widgets import GeditTerminalEnhancedPanel
+    from terminalenhanced.statcache import StatCache
+
+    directory = tempfile.mkdtemp(prefix='terminal-bench-')
+    os.makedirs(os.path.join(directory, 'src'))
+    open(os.path.join(directory, 'src', 'main.c'), 'w').close()
+
+    # without a shell reporting its directory, names are relative to ours
+    previous_cwd = os.getcwd()
+    os.chdir(directory)
+
+    plugin = BenchPlugin()
+    panel = GeditTerminalEnhancedPanel(plugin)
+    window = show(panel)
+    term = panel.ensure_terminal()
+    term.feed(b'\r\nsrc/main.c:12:3: error: expected declaration\r\n')
+    iterate()
+
+    column, row = term.get_cursor_position()
+    padding = term.get_style_context().get_padding(term.get_state_flags())
+    x = padding.left + term.get_char_width() * 2.5
+    y = padding.top + (row - 1 - term.get_vadjustment().get_value() + 0.5) * term.get_char_height()
+
+    event = make_button_event(term.get_window(), x, y, Gdk.ModifierType.CONTROL_MASK)
+
+    def open_file(cwd, name, line, column=0):
+        StatCache.get_default().check(cwd, name, lambda exists, is_dir: plugin.opened.append(name))
+
+    plugin.open_file = open_file
+
+    def click():
+        count = len(plugin.opened)
+        term.on_button_press(term, event.button)
+        iterate(until=lambda: len(plugin.opened) > count)
+
+    def click_uncached():
+        StatCache.get_default().entries.clear()
+        click()
+
+    result = {
+        'uncached': summarize(measure(click_uncached, repeat)),
+        'cached': summarize(measure(click, repeat)),
+    }
+
+    window.destroy()
+    os.chdir(previous_cwd)
+    return result
+
+
+def bench_feed(repeat):
+    """Throughput of sending a large input to the child through the feed queue, in MiB/s"""
+
+    from gi.repository import Vte
+    from terminalenhanced.widgets import GeditTerminal
+
+    term = GeditTerminal()
+    window = show(term)
+
+    # a child that swallows its input without echoing it, so only sending it is measured
+    term.spawn_async(Vte.PtyFlags.DEFAULT, None, ['/bin/sh', '-c', 'stty -echo; exec cat > /dev/null'], None,
+                     GeditTerminal.SPAWN_FLAGS, None, None, -1, None, term.on_shell_spawned, None)
+    iterate(until=lambda: term.child_pid)
+    time.sleep(0.2)
+
+    data = ('x' * 79 + '\n') * (FEED_SIZE // 80)
+
+    def feed():
+        term.feeder.push(data)
+        iterate(timeout=60, until=lambda: not term.feeder.is_busy())
+
+    durations = measure(feed, repeat)
+    window.destroy()
+
+    return {'mib-per-second': summarize([len(data) / 1024 / 1024 / (duration / 1000) for duration in durations])}
+
+
+BENCHMARKS = [
+    ('key-dispatch', bench_key_dispatch),
+    ('click-to-open', bench_click_to_open),
+    ('feed', bench_feed),
+]
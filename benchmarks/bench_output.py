@@ -0,0 +1,88 @@
+"""Printing large outputs, and memory used by the scrollback"""
+
+from harness import iterate, measure, summarize, show, get_rss
+
+OUTPUT_LINES = 100000
+MEMORY_TERMINALS = 4
+MEMORY_LINES = 50000
+
+
+def make_output(lines):
+    # like grep -n or compiler output, every line is a result for the index
+    return b''.join(b'src/module%d/file%d.c:%d: warning: unused variable\r\n' % (i % 50, i, i)
+                    for i in range(lines))
+
+
+def print_output(term, data, lines):
+    column, start_row = term.get_cursor_position()
+
+    for offset in range(0, len(data), 65536):
+        term.feed(data[offset:offset + 65536])
+
+    # done when it's all on the screen and the output index has caught up
+    iterate(timeout=120, until=lambda: term.get_cursor_position()[1] >= start_row + lines
+                                       and not term.output_index.update_id)
+
+
+def bench_print_output(repeat):
+    """Printing a large output, in lines per second, with and without the highlight regexes"""
+
+    from terminalenhanced.widgets import GeditTerminal
+
+    data = make_output(OUTPUT_LINES)
+    result = {}
+
+    for name, highlight in (('with-highlight', True), ('without-highlight', False)):
+        term = GeditTerminal()
+        window = show(term)
+        term.set_highlight_enabled(highlight)
+
+        durations = measure(lambda: print_output(term, data, OUTPUT_LINES), repeat)
+        result[name + '-lines-per-second'] = summarize([OUTPUT_LINES / (duration / 1000) for duration in durations])
+
+        window.destroy()
+
+    return result
+
+
+def bench_memory(repeat):
+    """Resident memory per terminal with a large scrollback, in KiB"""
+
+    from gi.repository import Gtk
+    from terminalenhanced.widgets import GeditTerminal
+    from terminalenhanced.settings import Settings
+
+    # measure the terminals themselves, without moving anything to disk
+    settings = Settings.get_shared()
+    settings.set_int('scrollback-budget', 0)
+    settings.set_int('scrollback-global-budget', 0)
+
+    data = make_output(MEMORY_LINES)
+    per_terminal = []
+
+    for i in range(repeat):
+        box = Gtk.Box()
+        window = show(box)
+        before = get_rss()
+
+        for j in range(MEMORY_TERMINALS):
+            term = GeditTerminal()
+            term.set_scrollback_lines(-1)
+            term.show()
+            box.pack_start(term, True, True, 0)
+            print_output(term, data, MEMORY_LINES)
+
+        per_terminal.append((get_rss() - before) / MEMORY_TERMINALS)
+        window.destroy()
+        iterate()
+
+    settings.reset('scrollback-budget')
+    settings.reset('scrollback-global-budget')
+
+    return {'kib-per-terminal': summarize(per_terminal), 'lines': MEMORY_LINES}
+
+
+BENCHMARKS = [
+    ('print-output', bench_print_output),
+    ('memory', bench_memory),
+]
@@ -0,0 +1,84 @@
+"""Import time and time to the first prompt"""
+
+import sys
+import json
+import subprocess
+
+from harness import ROOT, iterate, measure, summarize, show
+
+IMPORT_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, %r)
+started = time.perf_counter()
+import terminalenhanced
+imported = time.perf_counter()
+from terminalenhanced import workarounds
+workarounds.vte.vte_terminal_event_check_regex_simple
+workarounds.glib.g_free
+loaded = time.perf_counter()
+print(json.dumps({'import': (imported - started) * 1000, 'native': (loaded - imported) * 1000}))
+'''
+
+
+def bench_import(repeat):
+    """Importing the plugin, and loading the native libraries used by workarounds.py"""
+
+    imports, natives = [], []
+
+    for i in range(repeat):
+        # a fresh interpreter each time, nothing may be cached
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT % ROOT], cwd=ROOT)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+
+        imports.append(result['import'])
+        natives.append(result['native'])
+
+    return {'import': summarize(imports), 'native-libraries': summarize(natives)}
+
+
+def has_prompt(term):
+    # the prompt leaves the cursor somewhere after the first column
+    column, row = term.get_cursor_position()
+    return column > 0
+
+
+def bench_first_prompt(repeat):
+    """From start_shell until the prompt is printed, spawning a shell or adopting a pooled one"""
+
+    from terminalenhanced.widgets import GeditTerminal
+    from terminalenhanced.pool import ShellPool
+
+    def first_prompt(pool=None):
+        term = GeditTerminal()
+        window = show(term)
+
+        def run():
+            term.start_shell(pool)
+            iterate(until=lambda: has_prompt(term))
+
+        duration, = measure(run, 1)
+        window.destroy()
+        return duration
+
+    spawned = [first_prompt() for i in range(repeat)]
+
+    pool = ShellPool.get_default()
+    pooled = []
+
+    for i in range(repeat):
+        # the pool is refilled in the background, like between windows in gedit
+        pool.schedule_refill()
+        iterate(until=lambda: pool.ready)
+        iterate(timeout=1)
+
+        pooled.append(first_prompt(pool))
+
+    pool.shutdown()
+
+    return {'spawned': summarize(spawned), 'pooled': summarize(pooled)}
+
+
+BENCHMARKS = [
+    ('import', bench_import),
+    ('first-prompt', bench_first_prompt),
+]
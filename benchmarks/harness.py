@@ -0,0 +1,127 @@
+"""Helpers shared by the benchmarks
+
+Benchmarks run against a real display (Xvfb or broadway), with settings kept
+in memory so they never touch the user's configuration."""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('GSETTINGS_BACKEND', 'memory')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Gdk', '3.0')
+gi.require_version('Vte', '2.91')
+
+from gi.repository import Gdk, Gtk
+
+
+class Timeout(Exception):
+    pass
+
+
+def iterate(timeout=10, until=None):
+    """Runs the main loop until until() returns true, or until it's idle if there's no condition"""
+
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if until is not None and until():
+            return
+
+        if until is None and not Gtk.events_pending():
+            return
+
+        Gtk.main_iteration_do(until is not None)
+
+    raise Timeout()
+
+
+def measure(func, repeat):
+    """Returns durations of repeat calls to func, in milliseconds"""
+
+    durations = []
+
+    for i in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return durations
+
+
+def summarize(durations):
+    durations = sorted(durations)
+
+    return {
+        'runs': len(durations),
+        'min': durations[0],
+        'median': durations[len(durations) // 2],
+        'max': durations[-1],
+    }
+
+
+def get_rss():
+    """Resident memory of this process, in KiB"""
+
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def show(widget):
+    """Puts widget into a mapped window, so it's drawn like in gedit"""
+
+    window = Gtk.Window()
+    window.set_default_size(800, 400)
+    window.add(widget)
+    window.show_all()
+
+    iterate(until=widget.get_mapped)
+    return window
+
+
+class BenchPlugin:
+    """Stands in for TerminalEnhancedPlugin, so the panel can run without a gedit window"""
+
+    def __init__(self):
+        from terminalenhanced.stats import Stats
+
+        self.window = Gtk.Window()
+        self.stats = Stats()
+        self.session = None
+        self.opened = []
+
+    def open_file(self, cwd, name, line, column=0):
+        self.opened.append((cwd, name, line, column))
+
+    def get_active_document_directory(self):
+        return None
+
+    def get_active_document_path(self):
+        return None
+
+
+def make_key_event(window, keyval, state=0):
+    event = Gdk.Event.new(Gdk.EventType.KEY_PRESS)
+    event.key.window = window
+    event.key.keyval = keyval
+    event.key.state = state
+    event.key.time = Gtk.get_current_event_time()
+    return event
+
+
+def make_button_event(window, x, y, state=0):
+    event = Gdk.Event.new(Gdk.EventType.BUTTON_PRESS)
+    event.button.window = window
+    event.button.button = 1
+    event.button.x = x
+    event.button.y = y
+    event.button.state = state
+    event.button.time = Gtk.get_current_event_time()
+    return event
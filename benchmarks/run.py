@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Runs the benchmarks and prints the results as JSON
+
+These need a display, run them under Xvfb (or broadway), e.g.:
+
+    xvfb-run -a python3 benchmarks/run.py --output results.json
+
+The schemas have to be compiled first (make schemas)."""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import ROOT, Gtk
+
+import bench_startup
+import bench_input
+import bench_output
+
+BENCHMARKS = bench_startup.BENCHMARKS + bench_input.BENCHMARKS + bench_output.BENCHMARKS
+
+
+def get_environment():
+    from gi.repository import Vte
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'gtk': '%d.%d.%d' % (Gtk.get_major_version(), Gtk.get_minor_version(), Gtk.get_micro_version()),
+        'vte': '%d.%d.%d' % (Vte.get_major_version(), Vte.get_minor_version(), Vte.get_micro_version()),
+        'shell': Vte.get_user_shell(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default: %s'
+                        % ', '.join(name for name, func in BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each benchmark')
+    parser.add_argument('--output', help='file to write the results to, instead of stdout')
+    parser.add_argument('--shell', help='shell to start in terminals, instead of the user shell')
+    args = parser.parse_args()
+
+    if args.shell:
+        os.environ['SHELL'] = args.shell
+
+    unknown = set(args.names) - set(name for name, func in BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    results = {}
+
+    for name, func in BENCHMARKS:
+        if args.names and name not in args.names:
+            continue
+
+        print('running %s...' % name, file=sys.stderr)
+
+        try:
+            results[name] = func(args.repeat)
+        except Exception:
+            # one broken benchmark shouldn't lose the results of the others
+            traceback.print_exc()
+            results[name] = {'error': traceback.format_exc(limit=1).strip().splitlines()[-1]}
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': get_environment(),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
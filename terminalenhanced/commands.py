@@ -0,0 +1,218 @@
+import os
+import time
+import itertools
+from collections import deque
+
+from gi.repository import GObject, GLib, Vte
+
+
+class CommandQueue(GObject.Object):
+    """Commands run one after another in a terminal's shell
+
+    A command is sent when the shell is idle at its prompt, and never before
+    the first prompt: a shell that's still reading its rc files, or whose
+    first prompt VTE hasn't processed yet, is already in the foreground.
+    The first prompt is either marked by the shell, or it's the output after
+    the shell was started going quiet.
+
+    If the shell marks its prompts with OSC 133 (which VTE exposes as shell
+    termprops), we know exactly when a command has finished and its exit status.
+    Otherwise a command is considered finished when the shell is back in the
+    foreground of its terminal and there's been no output for a moment, and
+    the status is reported as -1."""
+
+    __gsignals__ = {
+        "command-started": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_INT, GObject.TYPE_STRING,)
+        ),
+        "command-finished": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_INT, GObject.TYPE_STRING, GObject.TYPE_INT, GObject.TYPE_DOUBLE,)
+        ),
+    }
+
+    POLL_INTERVAL = 200
+
+    ids = itertools.count(1)
+
+    def __init__(self, terminal):
+        super().__init__()
+
+        self.terminal = terminal
+        self.queue = deque()
+        self.running = None
+        self.running_id = 0
+        self.prompt_row = 0
+        self.started = 0
+        self.status = -1
+        self.poll_id = 0
+        self.changed = False
+
+        # the shell has printed its first prompt, and there's been output from it
+        self.prompt_seen = False
+        self.output_seen = False
+        # the running command was written to the shell, not just queued in the feeder
+        self.sent = False
+
+        # set once we see the shell mark a prompt
+        self.integrated = False
+        if hasattr(Vte, 'TERMPROP_SHELL_PRECMD'):
+            terminal.connect('termprop-changed', self.on_termprop_changed)
+
+        terminal.feeder.connect('finished', self.on_feed_finished)
+        terminal.connect('contents-changed', self.on_contents_changed)
+        terminal.connect('child-exited', self.on_child_exited)
+        terminal.connect('destroy', self.on_destroy)
+
+    def push(self, commands):
+        """Queues commands, returns their ids"""
+
+        queued = [(next(self.ids), command) for command in commands]
+
+        self.queue.extend(queued)
+        self.run_next()
+
+        return [command_id for command_id, command in queued]
+
+    def is_shell_idle(self):
+        pty = self.terminal.get_pty()
+        if not pty or self.terminal.child_pid is None:
+            return False
+
+        try:
+            return os.tcgetpgrp(pty.get_fd()) == self.terminal.child_pid
+        except OSError:
+            return False
+
+    def run_next(self):
+        if self.running is not None or not self.queue:
+            return
+
+        if not self.prompt_seen or not self.is_shell_idle():
+            # the shell is starting or busy with something the user typed
+            self.start_polling()
+            return
+
+        self.running_id, self.running = self.queue.popleft()
+        self.started = time.monotonic()
+        column, self.prompt_row = self.terminal.get_cursor_position()
+        self.status = -1
+        self.changed = True
+
+        self.emit('command-started', self.running_id, self.running)
+        self.terminal.feeder.push(self.running + '\n')
+
+        # behind some other input, it's sent when the feeder is done with it
+        self.sent = not self.terminal.feeder.is_busy()
+
+        if not self.integrated:
+            self.start_polling()
+
+    def start_polling(self):
+        if not self.poll_id:
+            self.poll_id = GLib.timeout_add(self.POLL_INTERVAL, self.poll)
+
+    def poll(self):
+        if self.running is None:
+            # waiting for the shell to become idle
+            if not self.is_shell_idle():
+                return GLib.SOURCE_CONTINUE
+
+            if not self.prompt_seen:
+                # without prompt markers, the first prompt is when the output stops
+                if self.changed or not self.output_seen:
+                    self.changed = False
+                    return GLib.SOURCE_CONTINUE
+
+                self.prompt_seen = True
+
+            self.poll_id = 0
+            self.run_next()
+            return GLib.SOURCE_REMOVE
+
+        if self.integrated:
+            # the prompt marker will tell us
+            self.poll_id = 0
+            return GLib.SOURCE_REMOVE
+
+        # the shell is back and nothing changed since the last poll
+        if not self.changed and not self.terminal.feeder.is_busy() and self.is_shell_idle():
+            self.poll_id = 0
+            self.finish()
+            return GLib.SOURCE_REMOVE
+
+        self.changed = False
+        return GLib.SOURCE_CONTINUE
+
+    def on_contents_changed(self, term):
+        self.changed = True
+
+        # a restored session is fed before the shell is started, it's not the shell's output
+        if term.child_pid is not None:
+            self.output_seen = True
+
+    def on_feed_finished(self, feeder, cancelled):
+        if self.running is None or self.sent:
+            return
+
+        if cancelled:
+            # the command never reached the shell
+            self.status = -1
+            self.finish()
+        else:
+            self.sent = True
+
+    def on_termprop_changed(self, term, name):
+        if name == Vte.TERMPROP_SHELL_POSTEXEC:
+            valid, status = term.get_termprop_uint(name)
+            self.status = status if valid else -1
+        elif name == Vte.TERMPROP_SHELL_PRECMD:
+            self.integrated = True
+            self.prompt_seen = True
+
+            # a new prompt, so the command is done, unless it's the prompt
+            # that was there before the command was written
+            if self.running is not None and self.sent:
+                self.finish()
+            else:
+                self.run_next()
+
+    def finish(self):
+        command, self.running = self.running, None
+        self.emit('command-finished', self.running_id, command, self.status, time.monotonic() - self.started)
+
+        self.run_next()
+
+    def cancel(self):
+        """Drops commands that haven't been started, they're reported as finished with status -1"""
+
+        dropped = list(self.queue)
+        self.queue.clear()
+
+        for command_id, command in dropped:
+            self.emit('command-finished', command_id, command, -1, 0)
+
+    def on_child_exited(self, term, status):
+        # the shell is gone and so are the commands it hasn't run yet
+        self.integrated = False
+        self.prompt_seen = False
+        self.output_seen = False
+        queued = list(self.queue)
+        self.queue.clear()
+
+        if self.running is not None:
+            self.status = -1
+            self.finish()
+
+        self.queue.extend(queued)
+        self.cancel()
+
+    def on_destroy(self, term):
+        self.queue.clear()
+
+        if self.poll_id:
+            GLib.source_remove(self.poll_id)
+            self.poll_id = 0
@@ -0,0 +1,125 @@
+import os
+from collections import deque
+
+from gi.repository import GObject, GLib
+from .stats import timed, start_timer
+
+
+class FeedQueue(GObject.Object):
+    """Input for a terminal's child, written in chunks as the PTY drains
+
+    Short strings go directly to feed_child, larger inputs are queued and
+    written CHUNK_SIZE bytes at a time whenever the PTY is writable, so the
+    main loop keeps running while a big script or thousands of dropped file
+    names are sent."""
+
+    __gsignals__ = {
+        "progress": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_UINT64, GObject.TYPE_UINT64,)
+        ),
+        "finished": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_BOOLEAN,)
+        ),
+    }
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, terminal):
+        super().__init__()
+
+        self.terminal = terminal
+        self.pieces = deque()
+        self.written = 0
+        self.total = 0
+        self.watch_id = 0
+        self.started = None
+
+        terminal.connect('destroy', lambda term: self.cancel())
+
+    @property
+    def stats(self):
+        return self.terminal.stats
+
+    def is_busy(self):
+        return bool(self.pieces)
+
+    @timed('feed')
+    def push(self, data):
+        """Queues a string, or a list of strings that are sent one after another"""
+
+        pieces = [s.encode('utf-8') for s in ([data] if isinstance(data, str) else data)]
+        size = sum(len(piece) for piece in pieces)
+
+        if not self.pieces and size <= self.CHUNK_SIZE and self.terminal.get_pty():
+            self.terminal.feed_child(b''.join(pieces))
+            return
+
+        if not self.pieces:
+            self.started = start_timer()
+
+        # memoryviews, so that writing a part of a piece doesn't copy the rest
+        self.pieces.extend(memoryview(piece) for piece in pieces if piece)
+        self.total += size
+        self.resume()
+
+    def resume(self):
+        """Starts writing, if there's something to write and the child is there"""
+
+        pty = self.terminal.get_pty()
+
+        if self.pieces and pty and not self.watch_id:
+            self.watch_id = GLib.io_add_watch(pty.get_fd(), GLib.PRIORITY_DEFAULT,
+                                              GLib.IOCondition.OUT | GLib.IOCondition.ERR | GLib.IOCondition.HUP,
+                                              self.on_writable)
+
+    def on_writable(self, fd, condition):
+        if condition & (GLib.IOCondition.ERR | GLib.IOCondition.HUP):
+            self.cancel()
+            return GLib.SOURCE_REMOVE
+
+        # one chunk per wakeup, anything else waits for the next one
+        piece = self.pieces[0]
+
+        try:
+            written = os.write(fd, piece[:self.CHUNK_SIZE])
+        except BlockingIOError:
+            return GLib.SOURCE_CONTINUE
+        except OSError:
+            self.cancel()
+            return GLib.SOURCE_REMOVE
+
+        if written < len(piece):
+            self.pieces[0] = piece[written:]
+        else:
+            self.pieces.popleft()
+
+        self.written += written
+        self.emit('progress', self.written, self.total)
+
+        if self.pieces:
+            return GLib.SOURCE_CONTINUE
+
+        self.watch_id = 0
+        self.finish(False)
+        return GLib.SOURCE_REMOVE
+
+    def cancel(self):
+        if self.watch_id:
+            GLib.source_remove(self.watch_id)
+            self.watch_id = 0
+
+        if self.pieces:
+            self.pieces.clear()
+            self.finish(True)
+
+    def finish(self, cancelled):
+        if self.stats and not cancelled:
+            # from queueing to the last chunk written
+            self.stats.since('feed-queued', self.started)
+
+        self.written = self.total = 0
+        self.emit('finished', cancelled)
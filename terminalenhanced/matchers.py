@@ -0,0 +1,176 @@
+import re
+
+from gi.repository import GObject, GLib, Vte
+from .settings import Settings
+from .search import PCRE2_MULTILINE, PCRE2_JIT_COMPLETE
+
+# name: (regex, highlight regex, name group, line group, column group, is url)
+BUILTIN_MATCHERS = {
+    'python-traceback': (r'''File "([^"]+)", line (\d+)''', None, 1, 2, 0, False),
+    'rustc': (r'''--> ([^:\s]+):(\d+):(\d+)''', None, 1, 2, 3, False),
+    'url': (r'''\b(?:https?|ftp)://[^\s<>"'()\[\]]*[^\s<>"'()\[\].,;:!?]''', None, 0, 0, 0, True),
+    # anything that looks like a name can be clicked, but only names at the start
+    # of a row that contain a slash or a dot are highlighted, like grep -n output
+    'path': (r'''([^:(),"'\s]+)(?::(\d+))?(?::(\d+))?:?''',
+             r'''^([^:(),"'\s]*?[/.][^:(),"'\s]*)(?::(\d+))?(?::(\d+))?:?''', 1, 2, 3, False),
+}
+
+
+def compile_vregex(regex_str):
+    vregex = Vte.Regex.new_for_match(regex_str, -1, PCRE2_MULTILINE)
+
+    try:
+        vregex.jit(PCRE2_JIT_COMPLETE)
+    except GLib.Error:
+        pass
+
+    return vregex
+
+
+class Matcher:
+    """A rule recognizing file references (or URLs) in the output
+
+    VTE only gives us the text of a match, so the groups are taken from the
+    same pattern compiled with Python's re, which is only run on that text."""
+
+    def __init__(self, name, regex_str, highlight_regex_str, name_group, line_group, column_group, is_url):
+        self.name = name
+        self.is_url = is_url
+        self.groups = (name_group, line_group, column_group)
+
+        self.vregex = compile_vregex(regex_str)
+        self.pattern = re.compile(regex_str)
+
+        if max(self.groups) > self.pattern.groups:
+            raise ValueError('no such group in %r' % regex_str)
+
+        if highlight_regex_str:
+            self.highlight_vregex = compile_vregex(highlight_regex_str)
+            self.highlight_pattern = re.compile(highlight_regex_str)
+        else:
+            self.highlight_vregex = self.vregex
+            self.highlight_pattern = self.pattern
+
+    def get_reference(self, match):
+        name_group, line_group, column_group = self.groups
+
+        line = match.group(line_group) if line_group else None
+        column = match.group(column_group) if column_group else None
+
+        return match.group(name_group), int(line or 0), int(column or 0)
+
+    def parse(self, text, highlighted=False):
+        """Returns (name, line, column) from the text VTE matched"""
+
+        match = (self.highlight_pattern if highlighted else self.pattern).match(text)
+        if not match:
+            return None
+
+        return self.get_reference(match)
+
+    def search(self, text):
+        """Returns (name, line, column) of the first highlighted reference in text"""
+
+        if self.is_url:
+            return None
+
+        match = self.highlight_pattern.search(text)
+        if not match:
+            return None
+
+        return self.get_reference(match)
+
+
+class MatcherRegistry(GObject.Object):
+    """Matchers configured in the plugin settings, shared by all terminals
+
+    Custom matchers come first, then built-in ones in the configured order.
+    Each one is compiled once and kept for as long as it's configured."""
+
+    __gsignals__ = {
+        "changed": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            ()
+        ),
+    }
+
+    __instance = None
+
+    @classmethod
+    def get_default(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        super().__init__()
+
+        self.compiled = {}
+        self.matchers = []
+        self.regexes = []
+        self.highlight_regexes = []
+
+        self.settings = Settings.get_shared()
+        self.settings.connect('changed::link-matchers', self.on_settings_changed)
+        self.settings.connect('changed::custom-link-matchers', self.on_settings_changed)
+
+        self.load()
+
+    def load(self):
+        rules = []
+
+        for idx, (regex_str, name_group, line_group, column_group) in enumerate(
+                self.settings.get_value('custom-link-matchers').unpack()):
+            rules.append(('custom-%d' % idx, (regex_str, None, name_group, line_group, column_group, False)))
+
+        for name in self.settings.get_strv('link-matchers'):
+            if name in BUILTIN_MATCHERS:
+                rules.append((name, BUILTIN_MATCHERS[name]))
+
+        compiled = {}
+        self.matchers = []
+
+        for name, rule in rules:
+            matcher = self.compiled.get(rule) or compiled.get(rule)
+
+            if matcher is None:
+                try:
+                    matcher = Matcher(name, *rule)
+                except (GLib.Error, re.error, ValueError):
+                    # an invalid custom rule shouldn't break the others
+                    continue
+
+            compiled[rule] = matcher
+            self.matchers.append(matcher)
+
+        self.compiled = compiled
+        self.regexes = [matcher.vregex for matcher in self.matchers]
+        self.highlight_regexes = [matcher.highlight_vregex for matcher in self.matchers]
+
+    def on_settings_changed(self, settings, key):
+        self.load()
+        self.emit('changed')
+
+    def get_match(self, matches, highlighted=False):
+        """Returns (matcher, (name, line, column)) for the first of the matches
+        returned by VTE for our regexes, or None"""
+
+        for matcher, text in zip(self.matchers, matches):
+            if text is not None:
+                reference = matcher.parse(text, highlighted)
+                if reference:
+                    return matcher, reference
+
+        return None
+
+    def search(self, text):
+        """Returns (name, line, column) of the first reference in a row"""
+
+        for matcher in self.matchers:
+            reference = matcher.search(text)
+            if reference:
+                return reference
+
+        return None
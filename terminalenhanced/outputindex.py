@@ -0,0 +1,94 @@
+import bisect
+from array import array
+
+from gi.repository import GLib
+
+
+class OutputIndex:
+    """Rows of a terminal which start with a name:line reference
+
+    The index is updated incrementally: only rows appended since the last
+    update are parsed, and at most MAX_ROWS_PER_UPDATE of them per idle
+    iteration. Only row numbers are kept, in an array, so huge build logs
+    don't cost much memory."""
+
+    MAX_ROWS_PER_UPDATE = 2000
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.rows = array('q')
+        self.next_row = 0
+        self.position = None
+        self.update_id = 0
+
+        terminal.connect('contents-changed', self.on_contents_changed)
+        terminal.connect('map', self.on_contents_changed)
+        terminal.connect('destroy', self.on_destroy)
+
+    def on_contents_changed(self, term):
+        # contents change many times per frame while output is flowing, and
+        # terminals in hidden tabs catch up once they're shown
+        if not self.update_id and term.get_mapped():
+            self.update_id = GLib.idle_add(self.update, priority=GLib.PRIORITY_LOW)
+
+    def on_destroy(self, term):
+        if self.update_id:
+            GLib.source_remove(self.update_id)
+            self.update_id = 0
+
+    def update(self):
+        column, cursor_row = self.terminal.get_cursor_position()
+        first_row = int(self.terminal.get_vadjustment().get_lower())
+
+        if cursor_row < self.next_row:
+            # the terminal was reset
+            self.rows = array('q')
+            self.next_row = 0
+            self.position = None
+
+        # the row with the cursor may not be complete yet
+        start = max(self.next_row, first_row)
+        end = min(cursor_row, start + self.MAX_ROWS_PER_UPDATE)
+
+        for row, name, line, column in self.terminal.get_results(start, end):
+            self.rows.append(row)
+
+        self.next_row = max(self.next_row, end)
+
+        # forget rows that are no longer in the scrollback
+        drop = bisect.bisect_left(self.rows, first_row)
+        if drop:
+            del self.rows[:drop]
+
+        if end < cursor_row:
+            return GLib.SOURCE_CONTINUE
+
+        self.update_id = 0
+        return GLib.SOURCE_REMOVE
+
+    def step(self, forward, from_row):
+        """Moves to the next (or previous) result and returns its row, or None if there's none
+
+        from_row is used when we haven't moved yet or the last result is gone"""
+
+        if self.update_id:
+            # make sure results that are already on the screen are there
+            GLib.source_remove(self.update_id)
+            self.update_id = 0
+            while self.update() == GLib.SOURCE_CONTINUE:
+                pass
+
+        row = self.position
+        if row is None or (self.rows and row < self.rows[0]):
+            row = from_row
+
+        if forward:
+            idx = bisect.bisect_right(self.rows, row)
+        else:
+            idx = bisect.bisect_left(self.rows, row) - 1
+
+        if not 0 <= idx < len(self.rows):
+            return None
+
+        self.position = self.rows[idx]
+        return self.position
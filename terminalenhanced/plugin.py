@@ -28,6 +28,11 @@ from gi.repository import GObject, Gio, Gedit, Peas, PeasGtk
 
 from .widgets import *
 from .settings import Settings
+from .pool import ShellPool
+from .statcache import StatCache
+from .session import TerminalSession
+from .stats import Stats, start_timer
+from .projectindex import ProjectIndex, find_git_root
 
 try:
     import gettext
@@ -51,18 +56,29 @@ class TerminalAppActivatable(GObject.Object, Gedit.AppActivatable, PeasGtk.Confi
             ('<Primary><Shift>C', 'term.copy-clipboard'),
             ('<Primary><Shift>V', 'term.paste-clipboard'),
             ('<Primary><Shift>F', 'term.paste-current-file'),
-            ('<Primary><Alt>T', 'win.focus-on-terminal')
+            ('<Primary><Shift>O', 'term.open-all-matches'),
+            ('<Primary><Shift>T', 'term.new-tab'),
+            ('<Primary><Shift>W', 'term.close-tab'),
+            ('<Primary><Alt>F', 'term.find'),
+            ('<Primary><Alt>T', 'win.focus-on-terminal'),
+            ('F8', 'win.next-terminal-result'),
+            ('<Shift>F8', 'win.previous-terminal-result'),
         )
 
     def do_activate(self):
         for accel, action in self.accelerators:
             self.app.set_accels_for_action(action, (accel,))
 
+        # start warming up shells before the first window asks for one
+        ShellPool.get_default().schedule_refill()
 
-    def deactivate(self):
+    def do_deactivate(self):
         for accel, action in self.accelerators:
             self.app.set_accels_for_action(action, [])
 
+        ShellPool.get_default().shutdown()
+        ProjectIndex.close_all()
+
     def do_create_configure_widget(self):
         return Settings.create_configure_widget()
 
@@ -75,6 +91,39 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
     class FeedString(Gedit.Message):
         str = GObject.Property(type=str)
 
+    class RunCommand(Gedit.Message):
+        command = GObject.Property(type=str)
+        id = GObject.Property(type=int)
+
+    class QueueCommands(Gedit.Message):
+        commands = GObject.Property(type=GObject.TYPE_STRV)
+        # decimal, in the order of commands
+        ids = GObject.Property(type=GObject.TYPE_STRV)
+
+    class SubscribeOutput(Gedit.Message):
+        command = GObject.Property(type=str)
+        id = GObject.Property(type=int)
+
+    class CommandOutput(Gedit.Message):
+        id = GObject.Property(type=int)
+        text = GObject.Property(type=str)
+        start_row = GObject.Property(type=GObject.TYPE_INT64)
+        end_row = GObject.Property(type=GObject.TYPE_INT64)
+        finished = GObject.Property(type=bool, default=False)
+
+    class ReadOutput(Gedit.Message):
+        cursor = GObject.Property(type=GObject.TYPE_INT64)
+        text = GObject.Property(type=str)
+
+    class GetStats(Gedit.Message):
+        stats = GObject.Property(type=str)
+
+    class CommandFinished(Gedit.Message):
+        id = GObject.Property(type=int)
+        command = GObject.Property(type=str)
+        status = GObject.Property(type=int, default=-1, minimum=-1)
+        duration = GObject.Property(type=float)
+
     def __init__(self):
         GObject.Object.__init__(self)
 
@@ -83,6 +132,18 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
         action.connect('activate', lambda a, p: self.focus_terminal())
         self.window.add_action(action)
 
+        # these work from the editor too, so we can step through results while fixing them
+        action = Gio.SimpleAction(name="next-terminal-result")
+        action.connect('activate', lambda a, p: self._panel.next_result())
+        self.window.add_action(action)
+
+        action = Gio.SimpleAction(name="previous-terminal-result")
+        action.connect('activate', lambda a, p: self._panel.previous_result())
+        self.window.add_action(action)
+
+        self.session = TerminalSession()
+        self.stats = Stats()
+
         self._panel = GeditTerminalEnhancedPanel(self)
         self._panel.show()
 
@@ -91,15 +152,28 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
         bottom.set_visible_child(self._panel)
 
         self.bus = self.window.get_message_bus()
+        self.open_cancellable = Gio.Cancellable()
 
         self.register_messages()
         self.install_filebrowser_extension()
 
     def do_deactivate(self):
         self.window.remove_action("focus-on-terminal")
+        self.window.remove_action("next-terminal-result")
+        self.window.remove_action("previous-terminal-result")
+        self.open_cancellable.cancel()
+        self.stats.stop()
+
+        # if the terminal was never shown, the previous session is still there
+        if self._panel._vte:
+            try:
+                self.session.save(self._panel._vte)
+            except OSError:
+                pass
 
         bottom = self.window.get_bottom_panel()
         bottom.remove(self._panel)
+        self._panel.destroy()
 
         self.unregister_messages()
         self.uninstall_filebrowser_extension()
@@ -109,9 +183,21 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
 
     def register_messages(self):
         self.bus.register(self.FeedString, '/plugins/terminalenhanced', 'feed-string')
+        self.bus.register(self.RunCommand, '/plugins/terminalenhanced', 'run-command')
+        self.bus.register(self.QueueCommands, '/plugins/terminalenhanced', 'queue-commands')
+        self.bus.register(self.CommandFinished, '/plugins/terminalenhanced', 'command-finished')
+        self.bus.register(self.SubscribeOutput, '/plugins/terminalenhanced', 'subscribe-output')
+        self.bus.register(self.CommandOutput, '/plugins/terminalenhanced', 'command-output')
+        self.bus.register(self.ReadOutput, '/plugins/terminalenhanced', 'read-output')
+        self.bus.register(self.GetStats, '/plugins/terminalenhanced', 'get-stats')
 
         self.signal_ids = []
         self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'feed-string', self.on_feed_string_message, None))
+        self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'run-command', self.on_run_command_message, None))
+        self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'queue-commands', self.on_queue_commands_message, None))
+        self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'subscribe-output', self.on_subscribe_output_message, None))
+        self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'read-output', self.on_read_output_message, None))
+        self.signal_ids.append(self.bus.connect('/plugins/terminalenhanced', 'get-stats', self.on_get_stats_message, None))
 
     def unregister_messages(self):
         for sid in self.signal_ids:
@@ -123,8 +209,36 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
         self.focus_terminal()
         self._panel.feed_string(message.props.str)
 
+    def on_run_command_message(self, bus, message, user_data):
+        message.props.id, = self._panel.run_commands([message.props.command])
+
+    def on_queue_commands_message(self, bus, message, user_data):
+        message.props.ids = [str(command_id) for command_id in self._panel.run_commands(message.props.commands)]
+
+    def on_subscribe_output_message(self, bus, message, user_data):
+        message.props.id = self._panel.subscribe_output(message.props.command)
+
+    def on_read_output_message(self, bus, message, user_data):
+        message.props.text, message.props.cursor = self._panel.read_output(message.props.cursor)
+
+    def on_get_stats_message(self, bus, message, user_data):
+        message.props.stats = self.stats.to_json()
+
+    def on_command_output(self, command_id, text, start_row, end_row, finished):
+        self.bus.send('/plugins/terminalenhanced', 'command-output', id=command_id, text=text,
+                      start_row=start_row, end_row=end_row, finished=finished)
+
+    def on_command_finished(self, command_id, command, status, duration):
+        self.bus.send('/plugins/terminalenhanced', 'command-finished',
+                      id=command_id, command=command, status=status, duration=duration)
+
     def install_filebrowser_extension(self):
         self.fb_menu_extension = None
+        self.fb_root_handler_id = None
+
+        if self.bus.is_registered('/plugins/filebrowser', 'root_changed'):
+            self.fb_root_handler_id = self.bus.connect('/plugins/filebrowser', 'root_changed',
+                                                       self.on_fb_root_changed, None)
 
         if self.bus.is_registered('/plugins/filebrowser', 'extend_context_menu'):
             msg = self.bus.send_sync('/plugins/filebrowser', 'extend_context_menu')
@@ -145,12 +259,21 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
             self.fb_menu_extension.append_menu_item(item)
 
     def uninstall_filebrowser_extension(self):
+        if self.fb_root_handler_id is not None:
+            self.bus.disconnect(self.fb_root_handler_id)
+            self.fb_root_handler_id = None
+
         if self.fb_menu_extension:
             self.window.remove_action('win.fb-paste-to-terminal')
             self.window.remove_action('win.fb-change-terminal-dir')
 
             self.fb_menu_extension = None
 
+    def on_fb_root_changed(self, bus, message, user_data):
+        location = message.props.location
+        if location and location.get_path():
+            self.prepare_project_index(location.get_path())
+
     def get_fb_selected_paths(self):
         try:
             view = self.bus.send_sync('/plugins/filebrowser', 'get_view').props.view
@@ -179,10 +302,14 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
         paths = self.get_fb_selected_paths()
         if paths:
             path = paths[0]
-            if not os.path.isdir(path):
-                path = os.path.dirname(path)
+            StatCache.get_default().check(os.path.dirname(path), os.path.basename(path),
+                                          lambda exists, is_dir: self.on_fb_change_terminal_dir_checked(path, is_dir))
+
+    def on_fb_change_terminal_dir_checked(self, path, is_dir):
+        if not is_dir:
+            path = os.path.dirname(path)
 
-            self._panel.feed_string('cd '+shlex.quote(path)+'\n')
+        self._panel.feed_string('cd '+shlex.quote(path)+'\n')
 
     def get_active_document_path(self):
         doc = self.window.get_active_document()
@@ -202,10 +329,114 @@ class TerminalEnhancedPlugin(GObject.Object, Gedit.WindowActivatable):
         self.window.get_bottom_panel().set_visible_child_name("GeditTerminalEnhancedPanel")
         self._panel.grab_focus()
 
-    def open_file(self, filename, line):
-        if os.path.exists(filename):
-            gio_file = Gio.File.new_for_path(filename)
-            Gedit.commands_load_location(self.window, gio_file, None, line, -1)
+    def open_file(self, cwd, name, line, column=0):
+        # the result is usually already known from highlighting, if not it's
+        # checked in the background so a slow filesystem doesn't block us.
+        # a newer click makes the previous one obsolete
+        self.open_cancellable.cancel()
+        self.open_cancellable = Gio.Cancellable()
+        started = start_timer()
+
+        StatCache.get_default().check(cwd, name,
+                                      lambda exists, is_dir: self.on_open_file_checked(cwd, name, line, column, exists, started),
+                                      self.open_cancellable)
+
+    def on_open_file_checked(self, cwd, name, line, column, exists, started=None):
+        if exists:
+            self.load_file(os.path.join(cwd, name), line, column)
+            self.stats.since('open-file', started)
+        elif Settings.get_shared().get_boolean('project-fallback'):
+            self.open_project_file(cwd, name, line, column, started)
+
+    def open_project_file(self, cwd, name, line, column, started=None):
+        # the output may come from a build in some subdirectory, or use paths
+        # relative to the project root, so we look for the name in the project
+        cancellable = self.open_cancellable
+
+        def on_resolved(path):
+            if path and not cancellable.is_cancelled():
+                self.load_file(path, line, column)
+                self.stats.since('open-file', started)
+
+        def on_root_found(root):
+            if root and not cancellable.is_cancelled():
+                ProjectIndex.get(root).resolve(name, on_resolved)
+
+        self.get_project_root(cwd, on_root_found, cancellable)
+
+    def prepare_project_index(self, cwd):
+        """Starts indexing the project of cwd, so the first fallback doesn't have to wait"""
+
+        if cwd and Settings.get_shared().get_boolean('project-fallback'):
+            self.get_project_root(cwd, lambda root: root and ProjectIndex.get(root))
+
+    def get_project_root(self, cwd, callback, cancellable=None):
+        """Calls callback(root) with the project directory of cwd, or None"""
+
+        root = None
+
+        if self.bus.is_registered('/plugins/filebrowser', 'get_root'):
+            location = self.bus.send_sync('/plugins/filebrowser', 'get_root').props.location
+            root = location.get_path() if location else None
+
+        # the filebrowser root is used if the output comes from inside it
+        if root and (cwd == root or cwd.startswith(root + os.sep)):
+            callback(root)
+            return
+
+        find_git_root(cwd, lambda git_root: callback(git_root or root), cancellable)
+
+    def load_file(self, filename, line, column=0):
+        gio_file = Gio.File.new_for_path(filename)
+        Gedit.commands_load_location(self.window, gio_file, None, line, column or -1)
+
+    def open_files(self, files):
+        """Opens all existing files from a list of (cwd, name, line, column) at once"""
+
+        results = [None] * len(files)
+        remaining = [len(files)]
+
+        def on_checked(idx, exists):
+            results[idx] = exists
+            remaining[0] -= 1
+
+            if not remaining[0]:
+                self.load_files([(os.path.join(cwd, name), line, column)
+                                 for (cwd, name, line, column), exists in zip(files, results) if exists])
+
+        for idx, (cwd, name, line, column) in enumerate(files):
+            StatCache.get_default().check(cwd, name, lambda exists, is_dir, idx=idx: on_checked(idx, exists))
+
+    def load_files(self, files):
+        locations = [(Gio.File.new_for_path(filename), line, column) for filename, line, column in files]
+
+        # one call for all new tabs, files that are already open are just activated
+        new_locations = [location for location, line, column in locations
+                         if not self.window.get_tab_from_location(location)]
+        if new_locations:
+            Gedit.commands_load_locations(self.window, new_locations, None, 0, 0)
+
+        for location, line, column in locations:
+            tab = self.window.get_tab_from_location(location)
+            if tab and line > 0:
+                self.goto_line(tab, line, column)
+
+    def goto_line(self, tab, line, column=0):
+        if tab.get_state() != Gedit.TabState.STATE_NORMAL:
+            # still loading, do it when it's done
+            def on_state_changed(tab, pspec):
+                if tab.get_state() == Gedit.TabState.STATE_NORMAL:
+                    tab.disconnect(handler_id)
+                    self.goto_line(tab, line, column)
+
+            handler_id = tab.connect('notify::state', on_state_changed)
+            return
+
+        if column > 0:
+            tab.get_document().goto_line_offset(line - 1, column - 1)
+        else:
+            tab.get_document().goto_line(line - 1)
+        tab.get_view().scroll_to_cursor()
 
 
 # Let's conform to PEP8
@@ -0,0 +1,117 @@
+import os
+import signal
+
+from gi.repository import GLib, Vte
+from .settings import Settings
+
+
+class ShellPool:
+    """Shells spawned ahead of time, ready to be adopted by new terminals"""
+
+    SPAWN_FLAGS = GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD
+
+    __instance = None
+
+    @classmethod
+    def get_default(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self.ready = []
+        self.spawning = 0
+        self.refill_id = 0
+
+        self.settings = Settings.get_shared()
+        self.settings_id = self.settings.connect('changed::shell-pool-size', lambda s, k: self.schedule_refill())
+
+    def get_size(self):
+        return self.settings.get_int('shell-pool-size')
+
+    def take(self):
+        """Returns a (pty, pid) tuple of an idle shell or None if there's none ready"""
+
+        shell = None
+
+        while self.ready:
+            pty, pid = self.ready.pop(0)
+
+            if self.is_alive(pid):
+                shell = (pty, pid)
+                break
+
+        self.schedule_refill()
+        return shell
+
+    def schedule_refill(self):
+        if not self.refill_id:
+            # low priority, we don't want to compete with whatever the user is doing
+            self.refill_id = GLib.idle_add(self.refill, priority=GLib.PRIORITY_LOW)
+
+    def refill(self):
+        self.refill_id = 0
+        size = self.get_size()
+
+        while len(self.ready) > size:
+            self.kill(*self.ready.pop())
+
+        for _ in range(size - len(self.ready) - self.spawning):
+            self.spawn()
+
+        return GLib.SOURCE_REMOVE
+
+    def spawn(self):
+        try:
+            pty = Vte.Pty.new_sync(Vte.PtyFlags.DEFAULT, None)
+        except GLib.Error:
+            return
+
+        self.spawning += 1
+        pty.spawn_async(None, [Vte.get_user_shell()], None, self.SPAWN_FLAGS,
+                        None, None, -1, None, self.on_spawned, None)
+
+    def on_spawned(self, pty, result, user_data):
+        self.spawning -= 1
+
+        try:
+            _, pid = pty.spawn_finish(result)
+        except GLib.Error:
+            return
+
+        if self.refill_id == -1 or len(self.ready) >= self.get_size():
+            # the pool was shut down or shrunk in the meantime
+            self.kill(pty, pid)
+        else:
+            self.ready.append((pty, pid))
+
+    def shutdown(self):
+        if self.refill_id > 0:
+            GLib.source_remove(self.refill_id)
+
+        # prevents further refills until the pool is used again
+        self.refill_id = -1
+
+        while self.ready:
+            self.kill(*self.ready.pop())
+
+        self.settings.disconnect(self.settings_id)
+        ShellPool.__instance = None
+
+    @staticmethod
+    def is_alive(pid):
+        try:
+            return os.waitpid(pid, os.WNOHANG) == (0, 0)
+        except ChildProcessError:
+            return False
+
+    @staticmethod
+    def kill(pty, pid):
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except ProcessLookupError:
+            pass
+
+        # reap it so it doesn't linger as a zombie
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, lambda *args: None)
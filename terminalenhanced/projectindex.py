@@ -0,0 +1,286 @@
+import os
+from collections import OrderedDict, deque
+
+from gi.repository import GLib, Gio
+
+
+# directory: the nearest directory containing .git, or None
+git_roots = OrderedDict()
+MAX_GIT_ROOTS = 256
+
+
+def find_git_root(path, callback, cancellable=None):
+    """Calls callback(root) with the nearest directory containing .git, or None
+
+    Directories are checked up the tree in GIO's worker threads, so a slow
+    filesystem doesn't block us, and results are remembered."""
+
+    if path in git_roots:
+        git_roots.move_to_end(path)
+        callback(git_roots[path])
+        return
+
+    check_git_root(path, path, callback, cancellable)
+
+
+def check_git_root(start, path, callback, cancellable):
+    gfile = Gio.File.new_for_path(os.path.join(path, '.git'))
+    gfile.query_info_async('standard::type', Gio.FileQueryInfoFlags.NONE, GLib.PRIORITY_DEFAULT,
+                           cancellable, on_git_root_checked, (start, path, callback, cancellable))
+
+
+def on_git_root_checked(gfile, result, data):
+    start, path, callback, cancellable = data
+
+    try:
+        gfile.query_info_finish(result)
+        root = path
+    except GLib.Error as e:
+        if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+            return
+
+        parent = os.path.dirname(path)
+        if parent and parent != path:
+            check_git_root(start, parent, callback, cancellable)
+            return
+
+        root = None
+
+    git_roots[start] = root
+    while len(git_roots) > MAX_GIT_ROOTS:
+        git_roots.popitem(last=False)
+
+    callback(root)
+
+
+def split_name(name):
+    """Components of a name from the output, without ./ and ../ prefixes"""
+
+    return [part for part in os.path.normpath(name).split(os.sep) if part not in ('', '.', '..')]
+
+
+class ProjectIndex:
+    """Files of a project directory, by name, for names that can't be found otherwise
+
+    The index is built in the background with GIO's asynchronous
+    enumeration, a directory at a time, and kept up to date with directory
+    monitors (at most MAX_MONITORS of them). A name is resolved with one
+    dictionary lookup, then the candidate whose path ends with the most
+    components of the name wins, and the shortest one if that's a tie."""
+
+    MAX_FILES = 200000
+    MAX_MONITORS = 2000
+    MAX_INDEXES = 4
+    FILES_PER_REQUEST = 256
+    IGNORED_DIRS = frozenset(['node_modules', '__pycache__'])
+    ATTRIBUTES = 'standard::name,standard::type,standard::is-hidden'
+
+    indexes = OrderedDict()
+
+    @classmethod
+    def get(cls, root):
+        """Returns the (shared) index of root, starting to build it if needed"""
+
+        index = cls.indexes.pop(root, None)
+
+        if index is None:
+            index = cls(root)
+            index.build()
+
+        cls.indexes[root] = index
+
+        # the least recently used one goes away
+        while len(cls.indexes) > cls.MAX_INDEXES:
+            root, old = cls.indexes.popitem(last=False)
+            old.close()
+
+        return index
+
+    @classmethod
+    def close_all(cls):
+        for index in cls.indexes.values():
+            index.close()
+
+        cls.indexes.clear()
+
+    def __init__(self, root):
+        self.root = root
+        self.by_name = {}
+        self.count = 0
+        self.pending = deque()
+        self.monitors = {}
+        self.callbacks = []
+        self.ready = False
+        self.cancellable = Gio.Cancellable()
+
+    def build(self):
+        self.pending.append('')
+        self.enumerate_next()
+
+    def close(self):
+        self.cancellable.cancel()
+
+        for monitor in self.monitors.values():
+            monitor.cancel()
+
+        self.monitors.clear()
+        self.pending.clear()
+        self.run_callbacks()
+
+    def add(self, path):
+        name = os.path.basename(path)
+        paths = self.by_name.setdefault(name, [])
+
+        if path not in paths:
+            paths.append(path)
+            self.count += 1
+
+    def remove(self, path):
+        """Forgets a file, or everything under a directory"""
+
+        paths = self.by_name.get(os.path.basename(path))
+        if paths and path in paths:
+            paths.remove(path)
+            self.count -= 1
+            return
+
+        prefix = path + os.sep
+        for name, paths in self.by_name.items():
+            kept = [p for p in paths if not p.startswith(prefix)]
+            self.count -= len(paths) - len(kept)
+            paths[:] = kept
+
+        for directory in [d for d in self.monitors if d.startswith(prefix)]:
+            self.monitors.pop(directory).cancel()
+
+    def enumerate_next(self):
+        if not self.pending or self.count >= self.MAX_FILES:
+            self.pending.clear()
+            self.ready = True
+            self.run_callbacks()
+            return
+
+        directory = self.pending.popleft()
+        gfile = Gio.File.new_for_path(os.path.join(self.root, directory))
+
+        self.watch(directory, gfile)
+        gfile.enumerate_children_async(self.ATTRIBUTES, Gio.FileQueryInfoFlags.NOFOLLOW_SYMLINKS,
+                                       GLib.PRIORITY_LOW, self.cancellable, self.on_enumerated, directory)
+
+    def on_enumerated(self, gfile, result, directory):
+        try:
+            enumerator = gfile.enumerate_children_finish(result)
+        except GLib.Error as e:
+            if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                # unreadable directory, just skip it
+                self.enumerate_next()
+            return
+
+        enumerator.next_files_async(self.FILES_PER_REQUEST, GLib.PRIORITY_LOW, self.cancellable,
+                                    self.on_next_files, directory)
+
+    def on_next_files(self, enumerator, result, directory):
+        try:
+            infos = enumerator.next_files_finish(result)
+        except GLib.Error as e:
+            if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                self.enumerate_next()
+            return
+
+        for info in infos:
+            self.add_info(directory, info)
+
+        if infos:
+            enumerator.next_files_async(self.FILES_PER_REQUEST, GLib.PRIORITY_LOW, self.cancellable,
+                                        self.on_next_files, directory)
+        else:
+            enumerator.close_async(GLib.PRIORITY_LOW, None, None, None)
+            self.enumerate_next()
+
+    def add_info(self, directory, info):
+        name = info.get_name()
+        path = os.path.join(directory, name)
+
+        if info.get_file_type() == Gio.FileType.DIRECTORY:
+            if not info.get_is_hidden() and name not in self.IGNORED_DIRS:
+                self.pending.append(path)
+        else:
+            self.add(path)
+
+    def watch(self, directory, gfile):
+        if len(self.monitors) >= self.MAX_MONITORS:
+            return
+
+        try:
+            monitor = gfile.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, self.cancellable)
+        except GLib.Error:
+            return
+
+        monitor.connect('changed', self.on_changed, directory)
+        self.monitors[directory] = monitor
+
+    def on_changed(self, monitor, gfile, other_file, event, directory):
+        path = os.path.relpath(gfile.get_path(), self.root)
+
+        if event in (Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT):
+            self.remove(path)
+        elif event in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.MOVED_IN):
+            self.index_new(path)
+        elif event == Gio.FileMonitorEvent.RENAMED:
+            self.remove(path)
+            self.index_new(os.path.relpath(other_file.get_path(), self.root))
+
+    def index_new(self, path):
+        gfile = Gio.File.new_for_path(os.path.join(self.root, path))
+        gfile.query_info_async(self.ATTRIBUTES, Gio.FileQueryInfoFlags.NOFOLLOW_SYMLINKS,
+                               GLib.PRIORITY_LOW, self.cancellable, self.on_new_queried, path)
+
+    def on_new_queried(self, gfile, result, path):
+        try:
+            info = gfile.query_info_finish(result)
+        except GLib.Error:
+            return
+
+        self.add_info(os.path.dirname(path), info)
+
+        if self.pending and self.ready:
+            # a new directory, index it too
+            self.ready = False
+            self.enumerate_next()
+
+    def lookup(self, name):
+        """Returns the absolute path of the best match for name, or None"""
+
+        parts = split_name(name)
+        if not parts:
+            return None
+
+        candidates = self.by_name.get(parts[-1])
+        if not candidates:
+            return None
+
+        def score(path):
+            path_parts = path.split(os.sep)
+            common = 0
+
+            while (common < len(parts) and common < len(path_parts)
+                   and parts[-1 - common] == path_parts[-1 - common]):
+                common += 1
+
+            return -common, len(path_parts), path
+
+        return os.path.join(self.root, min(candidates, key=score))
+
+    def resolve(self, name, callback):
+        """Calls callback(path) with the best match for name (or None), once the index is built"""
+
+        if self.ready:
+            callback(self.lookup(name))
+        else:
+            self.callbacks.append((name, callback))
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+
+        for name, callback in callbacks:
+            callback(self.lookup(name))
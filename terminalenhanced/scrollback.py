@@ -0,0 +1,178 @@
+import os
+import zlib
+import struct
+import weakref
+import itertools
+
+from gi.repository import GLib
+from .settings import Settings
+
+SPILL_DIR = os.path.join(GLib.get_user_cache_dir(), 'gedit-terminal-enhanced', 'scrollback')
+
+# deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+class ScrollbackSpill:
+    """Keeps the scrollback of a terminal within a memory budget
+
+    When the terminal's (estimated) scrollback size exceeds its budget, or all
+    terminals together exceed the global one, the oldest rows are appended to
+    a gzip file on disk and dropped from the terminal. The file can be opened
+    in gedit like any other (gedit reads gzip transparently).
+
+    gedit only reads the first member of a gzip file, so the file is a
+    single stream: each chunk is compressed and flushed, followed by the end
+    of the stream, which the next chunk overwrites."""
+
+    # rough size of a cell in memory, with attributes
+    CELL_SIZE = 8
+    # after spilling, we keep this much of the budget, so we don't spill on every line
+    KEEP_FRACTION = 0.5
+    ROWS_PER_CHUNK = 5000
+    CHECK_INTERVAL = 2
+    # we compress on the main loop, speed matters more than size
+    COMPRESS_LEVEL = 1
+
+    instances = weakref.WeakSet()
+    counter = itertools.count()
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.path = os.path.join(SPILL_DIR, '%d-%d.txt.gz' % (os.getpid(), next(self.counter)))
+        self.spilled_row = 0
+        self.check_id = 0
+        self.spill_id = 0
+
+        # the stream written so far, and where its end begins in the file
+        self.compressor = None
+        self.crc = 0
+        self.length = 0
+        self.end_offset = 0
+
+        self.settings = Settings.get_shared()
+        self.instances.add(self)
+
+        terminal.connect('contents-changed', self.on_contents_changed)
+        terminal.connect('destroy', self.on_destroy)
+
+    def has_spilled(self):
+        return self.spilled_row > 0
+
+    def get_row_size(self):
+        return self.terminal.get_column_count() * self.CELL_SIZE
+
+    def get_size(self):
+        vadj = self.terminal.get_vadjustment()
+        return int(vadj.get_upper() - vadj.get_lower()) * self.get_row_size()
+
+    def on_contents_changed(self, term):
+        if not self.check_id:
+            self.check_id = GLib.timeout_add_seconds(self.CHECK_INTERVAL, self.check_budget)
+
+    def on_destroy(self, term):
+        if self.check_id:
+            GLib.source_remove(self.check_id)
+            self.check_id = 0
+
+        self.discard()
+        self.instances.discard(self)
+
+    def discard(self):
+        """Forgets the rows written so far, for when the terminal's history is cleared"""
+
+        if self.spill_id:
+            GLib.source_remove(self.spill_id)
+            self.spill_id = 0
+
+        self.spilled_row = 0
+        self.compressor = None
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def check_budget(self):
+        self.check_id = 0
+
+        budget = self.settings.get_int('scrollback-budget') * 1024
+        global_budget = self.settings.get_int('scrollback-global-budget') * 1024
+
+        if budget and self.get_size() > budget:
+            self.spill(int(budget * self.KEEP_FRACTION))
+
+        if global_budget:
+            spills = [spill for spill in self.instances if not spill.spill_id]
+            total = sum(spill.get_size() for spill in spills)
+
+            if total > global_budget and spills:
+                # the biggest one gives up its share
+                largest = max(spills, key=lambda spill: spill.get_size())
+                largest.spill(int(global_budget / len(spills) * self.KEEP_FRACTION))
+
+        return GLib.SOURCE_REMOVE
+
+    def spill(self, keep_size):
+        """Writes out rows that don't fit in keep_size, and then drops them"""
+
+        if self.spill_id:
+            return
+
+        keep_rows = max(keep_size // self.get_row_size(), 0)
+        end_row = int(self.terminal.get_vadjustment().get_upper()) - self.terminal.get_row_count() - keep_rows
+
+        if end_row > self.spilled_row:
+            # rows are written in chunks, so we don't block for long
+            self.spill_id = GLib.idle_add(self.spill_chunk, end_row, keep_rows, priority=GLib.PRIORITY_LOW)
+
+    def spill_chunk(self, end_row, keep_rows):
+        # rows may have been dropped by the terminal itself in the meantime
+        start_row = max(self.spilled_row, int(self.terminal.get_vadjustment().get_lower()))
+        chunk_end = min(end_row, start_row + self.ROWS_PER_CHUNK)
+
+        if start_row < chunk_end:
+            rows = self.terminal.get_rows_text(start_row, chunk_end)
+            self.write(''.join(text + '\n' for row, text in rows).encode('utf-8'))
+
+        self.spilled_row = max(self.spilled_row, chunk_end)
+
+        if chunk_end < end_row:
+            return GLib.SOURCE_CONTINUE
+
+        # everything's on disk, we can drop it now. output may have arrived while
+        # writing, so only rows that were written go, the rest waits for the next spill
+        vadj = self.terminal.get_vadjustment()
+        unwritten = int(vadj.get_upper()) - self.terminal.get_row_count() - self.spilled_row
+        self.terminal.set_scrollback_lines(max(unwritten, keep_rows))
+        self.terminal.set_scrollback_lines(self.terminal.profile_settings.get_scrollback_lines())
+
+        self.spill_id = 0
+        return GLib.SOURCE_REMOVE
+
+    def write(self, data):
+        if self.compressor is None:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+
+            with open(self.path, 'wb') as f:
+                f.write(GZIP_HEADER)
+
+            self.compressor = zlib.compressobj(self.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self.crc = 0
+            self.length = 0
+            self.end_offset = len(GZIP_HEADER)
+
+        self.crc = zlib.crc32(data, self.crc)
+        self.length += len(data)
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        # finishing a copy keeps the stream open for the next chunk
+        end = self.compressor.copy().flush(zlib.Z_FINISH)
+        end += struct.pack('<II', self.crc, self.length & 0xffffffff)
+
+        with open(self.path, 'r+b') as f:
+            f.seek(self.end_offset)
+            f.write(compressed)
+            self.end_offset = f.tell()
+            f.write(end)
+            f.truncate()
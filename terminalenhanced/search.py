@@ -0,0 +1,190 @@
+import re
+import time
+import unicodedata
+
+from gi.repository import GObject, GLib, Vte
+
+PCRE2_CASELESS = 0x8
+PCRE2_MULTILINE = 0x400
+PCRE2_JIT_COMPLETE = 0x1
+
+
+class TerminalSearch(GObject.Object):
+    """Search in a terminal's scrollback
+
+    Stepping through matches is done by VTE itself, with a JIT-compiled
+    regex. Matches are also counted over the whole scrollback, a slice of rows
+    per idle iteration so typing in the search entry is never blocked, and
+    a new search simply makes the count of the previous one stale. Matches in
+    the visible rows are highlighted on top of the terminal."""
+
+    __gsignals__ = {
+        "counted": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_INT, GObject.TYPE_BOOLEAN,)
+        ),
+    }
+
+    ROWS_PER_SLICE = 500
+    # spent counting per idle iteration, so frames still get drawn in time
+    SLICE_TIME = 0.004
+    RECOUNT_DELAY = 500
+
+    HIGHLIGHT_COLOR = (0.99, 0.91, 0.31, 0.45)
+
+    def __init__(self, terminal):
+        super().__init__()
+
+        self.terminal = terminal
+        self.pattern = None
+        self.generation = 0
+        self.count_id = 0
+        self.recount_id = 0
+        self.draw_handler_id = 0
+        self.contents_handler_id = 0
+
+        terminal.connect('destroy', lambda term: self.clear())
+
+    def set_text(self, text, is_regex=False, match_case=False):
+        """Starts searching for text, returns False if it's not a valid regex"""
+
+        self.clear()
+
+        if not text:
+            return True
+
+        pattern = text if is_regex else re.escape(text)
+        flags = PCRE2_MULTILINE | (0 if match_case else PCRE2_CASELESS)
+
+        try:
+            vregex = Vte.Regex.new_for_search(pattern, -1, flags)
+        except GLib.Error:
+            return False
+
+        try:
+            vregex.jit(PCRE2_JIT_COMPLETE)
+        except GLib.Error:
+            # no JIT support in this PCRE2 build, it works just slower
+            pass
+
+        self.terminal.search_set_regex(vregex, 0)
+        self.terminal.search_set_wrap_around(True)
+
+        try:
+            self.pattern = re.compile(pattern, 0 if match_case else re.IGNORECASE)
+        except re.error:
+            # a PCRE-only construct, VTE can still search but we can't count or highlight
+            self.emit('counted', -1, True)
+            return True
+
+        self.draw_handler_id = self.terminal.connect_after('draw', self.on_draw)
+        self.contents_handler_id = self.terminal.connect('contents-changed', self.on_contents_changed)
+        self.terminal.queue_draw()
+
+        self.count()
+        return True
+
+    def clear(self):
+        self.generation += 1
+        self.pattern = None
+
+        for source_id in (self.count_id, self.recount_id):
+            if source_id:
+                GLib.source_remove(source_id)
+
+        self.count_id = self.recount_id = 0
+
+        for handler_id in (self.draw_handler_id, self.contents_handler_id):
+            if handler_id:
+                self.terminal.disconnect(handler_id)
+
+        self.draw_handler_id = self.contents_handler_id = 0
+
+        self.terminal.search_set_regex(None, 0)
+        self.terminal.queue_draw()
+
+    def find(self, forward):
+        if forward:
+            return self.terminal.search_find_next()
+
+        return self.terminal.search_find_previous()
+
+    def count(self):
+        self.generation += 1
+
+        if self.count_id:
+            GLib.source_remove(self.count_id)
+
+        start_row = int(self.terminal.get_vadjustment().get_lower())
+        self.count_id = GLib.idle_add(self.count_slice, self.generation, start_row, 0,
+                                      priority=GLib.PRIORITY_LOW)
+
+    def count_slice(self, generation, row, total):
+        if generation != self.generation:
+            # a newer search started in the meantime
+            return GLib.SOURCE_REMOVE
+
+        end_row = int(self.terminal.get_vadjustment().get_upper())
+        deadline = time.monotonic() + self.SLICE_TIME
+
+        while row < end_row and time.monotonic() < deadline:
+            slice_end = min(end_row, row + self.ROWS_PER_SLICE)
+
+            for r, text in self.terminal.get_rows_text(row, slice_end):
+                total += sum(1 for match in self.pattern.finditer(text) if match.end() > match.start())
+
+            row = slice_end
+
+        complete = row >= end_row
+        self.emit('counted', total, complete)
+
+        if complete:
+            self.count_id = 0
+            return GLib.SOURCE_REMOVE
+
+        # continue where we stopped, with what we've counted so far
+        self.count_id = GLib.idle_add(self.count_slice, generation, row, total,
+                                      priority=GLib.PRIORITY_LOW)
+        return GLib.SOURCE_REMOVE
+
+    def on_contents_changed(self, term):
+        # output is flowing, count again once it settles down
+        if self.recount_id:
+            GLib.source_remove(self.recount_id)
+
+        self.recount_id = GLib.timeout_add(self.RECOUNT_DELAY, self.on_recount)
+
+    def on_recount(self):
+        self.recount_id = 0
+        self.count()
+        return GLib.SOURCE_REMOVE
+
+    def on_draw(self, term, cr):
+        char_width = term.get_char_width()
+        char_height = term.get_char_height()
+        padding = term.get_style_context().get_padding(term.get_state_flags())
+        value = term.get_vadjustment().get_value()
+        first_row, last_row = term.get_visible_rows()
+
+        cr.set_source_rgba(*self.HIGHLIGHT_COLOR)
+
+        for row, text in term.get_rows_text(first_row, last_row + 1):
+            y = padding.top + (row - value) * char_height
+
+            for match in self.pattern.finditer(text):
+                if match.end() == match.start():
+                    continue
+
+                column = get_column(text, match.start())
+                width = get_column(text, match.end()) - column
+                cr.rectangle(padding.left + column * char_width, y, width * char_width, char_height)
+
+        cr.fill()
+        return False
+
+
+def get_column(text, index):
+    """Column of text[index], wide characters take two cells"""
+
+    return index + sum(1 for c in text[:index] if unicodedata.east_asian_width(c) in 'WF')
@@ -0,0 +1,170 @@
+import os
+import json
+import gzip
+import time
+import itertools
+
+from gi.repository import GLib
+from .settings import Settings
+
+SESSION_DIR = os.path.join(GLib.get_user_cache_dir(), 'gedit-terminal-enhanced', 'session')
+
+# sessions saved since then come from windows closed in this instance,
+# they're for the next start, not for windows opened later
+STARTED = time.time()
+
+
+class TerminalSession:
+    """Directory and recent output of a window's terminal, kept across restarts
+
+    Every window saves its terminal under a new name when it's closed, so
+    several gedit instances never overwrite each other. When a window creates
+    its first terminal, it claims the most recent session saved before this
+    instance started (renaming it, so no other window or instance gets it
+    too). The snapshot is fed to the terminal a chunk per idle iteration, and
+    only then the shell is started in the saved directory. Sessions older
+    than MAX_AGE are deleted."""
+
+    CHUNK_SIZE = 16384
+    MAX_AGE = 7 * 24 * 3600
+
+    counter = itertools.count()
+
+    def __init__(self):
+        self.restored = False
+        self.feed_id = 0
+        self.destroy_handler_id = 0
+
+    @staticmethod
+    def is_enabled():
+        return Settings.get_shared().get_boolean('restore-session')
+
+    def save(self, terminal):
+        if not self.is_enabled():
+            return
+
+        try:
+            cwd = terminal.get_cwd()
+        except OSError:
+            cwd = None
+
+        # the row with the cursor is the prompt, the new shell prints its own
+        lines = Settings.get_shared().get_int('session-scrollback-lines')
+        column, end_row = terminal.get_cursor_position()
+        start_row = max(end_row - lines, int(terminal.get_vadjustment().get_lower()))
+
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        name = '%d-%d-%d' % (time.time() * 1000, os.getpid(), next(self.counter))
+
+        with gzip.open(os.path.join(SESSION_DIR, name + '.txt.gz'), 'wt') as f:
+            for row, text in terminal.get_rows_text(start_row, end_row):
+                f.write(text + '\n')
+
+        # written last, a session without it is incomplete
+        with open(os.path.join(SESSION_DIR, name + '.json'), 'w') as f:
+            json.dump({'cwd': cwd}, f)
+
+    @classmethod
+    def claim(cls):
+        """Takes the most recent session saved before we started, returns
+        (claimed path, snapshot path) or None. Stale files are deleted."""
+
+        try:
+            names = os.listdir(SESSION_DIR)
+        except OSError:
+            return None
+
+        now = time.time()
+        sessions = []
+
+        for name in names:
+            path = os.path.join(SESSION_DIR, name)
+
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+
+            if mtime < now - cls.MAX_AGE:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            elif name.endswith('.json') and mtime < STARTED:
+                sessions.append((mtime, path))
+
+        for mtime, path in sorted(sessions, reverse=True):
+            claimed = '%s.%d' % (path, os.getpid())
+
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # some other instance was faster
+                continue
+
+            return claimed, path[:-len('.json')] + '.txt.gz'
+
+        return None
+
+    def restore(self, terminal):
+        """Restores a session into a new terminal and starts its shell,
+        returns False if there's nothing to restore"""
+
+        # only the first terminal of a window
+        if self.restored or not self.is_enabled():
+            return False
+
+        self.restored = True
+
+        session = self.claim()
+        if session is None:
+            return False
+
+        path, snapshot_path = session
+
+        try:
+            with open(path) as f:
+                cwd = json.load(f).get('cwd')
+        except (OSError, ValueError):
+            cwd = None
+
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+        if cwd and not os.path.isdir(cwd):
+            cwd = None
+
+        # the window may be closed before we're done
+        self.destroy_handler_id = terminal.connect('destroy', self.on_terminal_destroyed)
+        self.feed_id = GLib.idle_add(self.feed_snapshot, terminal, cwd, snapshot_path, None)
+        return True
+
+    def on_terminal_destroyed(self, terminal):
+        if self.feed_id:
+            GLib.source_remove(self.feed_id)
+            self.feed_id = 0
+
+    def feed_snapshot(self, terminal, cwd, snapshot_path, data):
+        if data is None:
+            try:
+                with gzip.open(snapshot_path, 'rt') as f:
+                    text = f.read()
+
+                os.unlink(snapshot_path)
+            except (OSError, EOFError):
+                text = ''
+
+            # the terminal needs carriage returns too
+            data = memoryview(text.replace('\n', '\r\n').encode('utf-8'))
+
+        if data:
+            terminal.feed(bytes(data[:self.CHUNK_SIZE]))
+            self.feed_id = GLib.idle_add(self.feed_snapshot, terminal, cwd, snapshot_path, data[self.CHUNK_SIZE:])
+            return GLib.SOURCE_REMOVE
+
+        self.feed_id = 0
+        terminal.disconnect(self.destroy_handler_id)
+        terminal.start_shell(cwd=cwd)
+        return GLib.SOURCE_REMOVE
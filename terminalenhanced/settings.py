@@ -1,13 +1,15 @@
 import os
 import subprocess
+import functools
 
-from gi.repository import Gio, Gtk
+from gi.repository import GObject, GLib, Gio, Pango, Gdk, Gtk
 
 SCHEMAS_PATH = os.path.join(os.path.dirname(__file__), 'schemas')
 PLUGIN_SCHEMA_ID = 'pl.zb3.gedit.terminal-enhanced'
 
 class Settings:
     schema_source = None
+    shared = {}
 
     @classmethod
     def get(cls, local_id=''):
@@ -22,6 +24,15 @@ class Settings:
         schema = cls.schema_source.lookup(schema_id, False)
         return Gio.Settings.new_full(schema, None, None)
 
+    @classmethod
+    def get_shared(cls, local_id=''):
+        # one instance per schema for the whole process, so that every window
+        # doesn't create its own dconf subscription
+        if local_id not in cls.shared:
+            cls.shared[local_id] = cls.get(local_id)
+
+        return cls.shared[local_id]
+
     @staticmethod
     def invoke_dconf_editor(local_path=''):
         env = os.environ.copy()
@@ -33,6 +44,10 @@ class Settings:
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
         box.set_border_width(20)
 
+        button = Gtk.Button.new_with_label("Edit plugin settings using dconf-editor")
+        button.connect('clicked', lambda x: cls.invoke_dconf_editor())
+        box.pack_start(button, True, False, 0)
+
         button = Gtk.Button.new_with_label("Edit profile settings using dconf-editor")
         button.connect('clicked', lambda x: cls.invoke_dconf_editor('profile'))
         box.pack_start(button, True, False, 0)
@@ -40,3 +55,178 @@ class Settings:
         return box
 
 
+@functools.lru_cache(maxsize=8)
+def parse_palette(str_colors):
+    # keyed by the raw strv, so switching between themes doesn't parse them again
+    palette = []
+
+    for str_color in str_colors:
+        try:
+            rgba = Gdk.RGBA()
+            rgba.parse(str_color)
+            palette.append(rgba)
+        except:
+            return []
+
+    return palette
+
+
+class ProfileSettings(GObject.Object):
+    """Terminal profile shared by all terminals in the process
+
+    The profile is resolved once and parsed values are cached until a key they
+    depend on changes. Changes are collected and passed on to all terminals at
+    once when idle, as a set of changed keys (None if everything changed)."""
+
+    __gsignals__ = {
+        "changed": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_PYOBJECT,)
+        )
+    }
+
+    # which cached values need to be dropped when a key changes
+    DEPENDENCIES = {
+        'font-desc': ('font', 'use-system-font', 'monospace-font-name'),
+        'colors': ('use-theme-colors', 'foreground-color', 'background-color'),
+        'scrollback-lines': ('scrollback-lines', 'scrollback-unlimited'),
+    }
+
+    __instance = None
+
+    @classmethod
+    def get_default(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        super().__init__()
+
+        self.cache = {}
+        self.changed_keys = set()
+        self.changed_id = 0
+        self.profiles = None
+        self.settings = None
+
+        source = Gio.SettingsSchemaSource.get_default()
+        if source and source.lookup("org.gnome.Terminal.ProfilesList", True):
+            self.profiles = Gio.Settings.new("org.gnome.Terminal.ProfilesList")
+            self.profiles.connect("changed::default", self.on_default_profile_changed)
+
+        self.settings_id = 0
+        self.load_profile()
+
+        self.system_settings = Gio.Settings.new("org.gnome.desktop.interface")
+        self.system_settings.connect("changed::monospace-font-name", self.on_settings_changed)
+
+    def load_profile(self):
+        if self.settings_id:
+            self.settings.disconnect(self.settings_id)
+
+        if self.profiles:
+            default_path = "/org/gnome/terminal/legacy/profiles:/:" + self.profiles.get_string("default") + "/"
+            self.settings = Gio.Settings.new_with_path("org.gnome.Terminal.Legacy.Profile",
+                                                       default_path)
+        else:
+            self.settings = Settings.get("profile")
+
+        self.settings_id = self.settings.connect("changed", self.on_settings_changed)
+        self.cache.clear()
+
+    def on_default_profile_changed(self, settings, key):
+        self.load_profile()
+
+        # everything might have changed
+        self.changed_keys = None
+        self.schedule_changed()
+
+    def on_settings_changed(self, settings, key):
+        for name, keys in self.DEPENDENCIES.items():
+            if key in keys:
+                self.cache.pop(name, None)
+
+        if self.changed_keys is not None:
+            self.changed_keys.add(key)
+
+        self.schedule_changed()
+
+    def schedule_changed(self):
+        # tools like dconf-editor write many keys at once, terminals should
+        # only be reconfigured once for all of them
+        if not self.changed_id:
+            self.changed_id = GLib.idle_add(self.emit_changed)
+
+    def emit_changed(self):
+        keys = self.changed_keys
+        self.changed_keys = set()
+        self.changed_id = 0
+
+        self.emit("changed", frozenset(keys) if keys is not None else None)
+        return GLib.SOURCE_REMOVE
+
+    def cached(self, name, compute):
+        if name not in self.cache:
+            self.cache[name] = compute()
+
+        return self.cache[name]
+
+    def get_boolean(self, key):
+        return self.settings.get_boolean(key)
+
+    def get_enum(self, key):
+        return self.settings.get_enum(key)
+
+    def get_int(self, key):
+        return self.settings.get_int(key)
+
+    def get_string(self, key):
+        return self.settings.get_string(key)
+
+    def get_strv(self, key):
+        return self.settings.get_strv(key)
+
+    def get_font_desc(self):
+        return self.cached('font-desc', self.parse_font_desc)
+
+    def parse_font_desc(self):
+        if self.settings.get_boolean("use-system-font"):
+            font = self.system_settings.get_string("monospace-font-name")
+        else:
+            font = self.settings.get_string("font")
+
+        return Pango.font_description_from_string(font)
+
+    def get_colors(self):
+        """Returns (fg, bg), None means the theme color should be used"""
+
+        return self.cached('colors', self.parse_colors)
+
+    def parse_colors(self):
+        fg = bg = None
+
+        if not self.settings.get_boolean("use-theme-colors"):
+            fg_color = self.settings.get_string("foreground-color")
+            if fg_color != "":
+                fg = Gdk.RGBA()
+                fg.parse(fg_color)
+            bg_color = self.settings.get_string("background-color")
+            if bg_color != "":
+                bg = Gdk.RGBA()
+                bg.parse(bg_color)
+
+        return fg, bg
+
+    def get_palette(self):
+        return parse_palette(tuple(self.settings.get_strv("palette")))
+
+    def get_scrollback_lines(self):
+        return self.cached('scrollback-lines', self.parse_scrollback_lines)
+
+    def parse_scrollback_lines(self):
+        if self.settings.get_boolean("scrollback-unlimited"):
+            return -1
+
+        return self.settings.get_int("scrollback-lines")
@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+
+from gi.repository import GLib, Gio
+
+
+class StatCache:
+    """Remembers which files exist, checking unknown ones asynchronously
+
+    Entries are keyed by (cwd, name) and hold an (exists, is_dir) tuple, they
+    expire after TTL seconds and the least recently used ones are evicted when
+    there's more than MAX_ENTRIES. Checks run in GIO's worker threads, so
+    a slow (network) filesystem never blocks the main loop."""
+
+    TTL = 10
+    MAX_ENTRIES = 2048
+
+    __instance = None
+
+    @classmethod
+    def get_default(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.pending = {}
+
+    def lookup(self, cwd, name):
+        """Returns (exists, is_dir), or None if we don't know yet"""
+
+        key = (cwd, name)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        result, timestamp = entry
+        if time.monotonic() - timestamp > self.TTL:
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return result
+
+    def check(self, cwd, name, callback=None, cancellable=None):
+        """Like lookup, but if the result is unknown, the file is checked in the background
+        and callback(exists, is_dir) is called when it's done, unless cancellable was
+        cancelled in the meantime"""
+
+        result = self.lookup(cwd, name)
+
+        if result is not None:
+            if callback:
+                callback(*result)
+            return result
+
+        key = (cwd, name)
+        callbacks = self.pending.get(key)
+
+        if callbacks is None:
+            callbacks = self.pending[key] = []
+
+            gio_file = Gio.File.new_for_path(os.path.join(cwd, name))
+            gio_file.query_info_async(Gio.FILE_ATTRIBUTE_STANDARD_TYPE, Gio.FileQueryInfoFlags.NONE,
+                                      GLib.PRIORITY_DEFAULT, None, self.on_checked, key)
+
+        if callback:
+            callbacks.append((callback, cancellable))
+
+        return None
+
+    def store(self, cwd, name, exists, is_dir=False):
+        key = (cwd, name)
+
+        self.entries[key] = ((exists, is_dir), time.monotonic())
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+    def on_checked(self, gio_file, async_result, key):
+        try:
+            info = gio_file.query_info_finish(async_result)
+            result = (True, info.get_file_type() == Gio.FileType.DIRECTORY)
+        except GLib.Error:
+            result = (False, False)
+
+        self.store(*key, *result)
+
+        for callback, cancellable in self.pending.pop(key, []):
+            if cancellable is None or not cancellable.is_cancelled():
+                callback(*result)
@@ -0,0 +1,132 @@
+import sys
+import json
+import time
+import bisect
+import weakref
+import functools
+
+from gi.repository import GLib
+from .settings import Settings
+
+
+class Histogram:
+    # upper bounds of buckets, in milliseconds
+    BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        labels = ['<=%g' % bound for bound in self.BOUNDS] + ['>%g' % self.BOUNDS[-1]]
+
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'buckets': {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+class Stats:
+    """Timings of a window's terminal operations, in milliseconds
+
+    Collecting is off unless collect-stats is set, and then all that
+    instrumented code pays is one check, so it can stay in place."""
+
+    enabled = False
+    settings = None
+    instances = weakref.WeakSet()
+
+    def __init__(self):
+        self.histograms = {}
+        self.log_id = 0
+
+        self.instances.add(self)
+
+        if Stats.settings is None:
+            Stats.settings = Settings.get_shared()
+            Stats.settings.connect('changed::collect-stats', lambda s, k: Stats.update_enabled())
+            Stats.update_enabled()
+        else:
+            self.update_log_timer()
+
+    @classmethod
+    def update_enabled(cls):
+        cls.enabled = cls.settings.get_boolean('collect-stats')
+
+        for stats in cls.instances:
+            stats.update_log_timer()
+
+    def update_log_timer(self):
+        # there's nothing to log while nothing is collected
+        interval = self.settings.get_int('stats-log-interval') if self.enabled else 0
+
+        if interval and not self.log_id:
+            self.log_id = GLib.timeout_add_seconds(interval, self.log)
+        elif not interval and self.log_id:
+            GLib.source_remove(self.log_id)
+            self.log_id = 0
+
+    def record(self, name, duration):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+
+        histogram.add(duration)
+
+    def since(self, name, started):
+        """Records the time elapsed since a time.perf_counter() value"""
+
+        if started is not None:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def to_json(self):
+        return json.dumps({name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())})
+
+    def log(self):
+        # gedit doesn't set up Python's logging, so it goes to stderr like its own messages
+        print('terminal stats: %s' % self.to_json(), file=sys.stderr, flush=True)
+        return GLib.SOURCE_CONTINUE
+
+    def stop(self):
+        self.instances.discard(self)
+
+        if self.log_id:
+            GLib.source_remove(self.log_id)
+            self.log_id = 0
+
+
+def start_timer():
+    """Returns a start time to pass to Stats.since, or None if stats are disabled"""
+
+    return time.perf_counter() if Stats.enabled else None
+
+
+def timed(name):
+    """Records how long a method takes in self.stats"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None or not Stats.enabled:
+                return func(self, *args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                stats.record(name, (time.perf_counter() - started) * 1000)
+
+        return wrapper
+
+    return decorator
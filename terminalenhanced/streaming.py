@@ -0,0 +1,91 @@
+from gi.repository import GObject, GLib
+
+
+class OutputStreamer(GObject.Object):
+    """Streams the output of subscribed commands as rows are completed
+
+    For every subscribed command, rows printed since the last update are sent
+    with the 'output' signal as (command id, text, start row, end row,
+    finished), so subscribers never have to read the whole terminal again.
+    The row with the cursor is left out until it's complete."""
+
+    __gsignals__ = {
+        "output": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_INT, GObject.TYPE_STRING, GObject.TYPE_INT64, GObject.TYPE_INT64, GObject.TYPE_BOOLEAN,)
+        ),
+    }
+
+    def __init__(self, terminal):
+        super().__init__()
+
+        self.terminal = terminal
+        self.subscribed = set()
+        self.active = {}
+        self.update_id = 0
+
+        terminal.commands.connect('command-started', self.on_command_started)
+        terminal.commands.connect('command-finished', self.on_command_finished)
+        terminal.connect('contents-changed', self.on_contents_changed)
+        terminal.connect('destroy', self.on_destroy)
+
+    def subscribe(self, command_id):
+        commands = self.terminal.commands
+
+        if command_id == commands.running_id and commands.running is not None:
+            # it was started right away
+            self.on_command_started(commands, command_id, commands.running, True)
+        else:
+            self.subscribed.add(command_id)
+
+    def on_command_started(self, commands, command_id, command, subscribed=False):
+        if subscribed or command_id in self.subscribed:
+            # the output starts below the line with the command
+            self.active[command_id] = commands.prompt_row + 1
+
+    def on_command_finished(self, commands, command_id, command, status, duration):
+        if command_id in self.active:
+            # the cursor is at the new prompt, so everything above it is output
+            self.flush(command_id, True)
+            del self.active[command_id]
+        elif command_id in self.subscribed:
+            # it never ran, but the subscriber is still waiting for the end
+            column, row = self.terminal.get_cursor_position()
+            self.emit('output', command_id, '', row, row, True)
+
+        self.subscribed.discard(command_id)
+
+    def on_contents_changed(self, term):
+        if self.active and not self.update_id:
+            self.update_id = GLib.idle_add(self.update, priority=GLib.PRIORITY_LOW)
+
+    def on_destroy(self, term):
+        if self.update_id:
+            GLib.source_remove(self.update_id)
+            self.update_id = 0
+
+    def update(self):
+        self.update_id = 0
+
+        for command_id in list(self.active):
+            self.flush(command_id, False)
+
+        return GLib.SOURCE_REMOVE
+
+    def flush(self, command_id, finished):
+        start_row = max(self.active[command_id], int(self.terminal.get_vadjustment().get_lower()))
+        text, end_row = self.read(start_row)
+
+        if end_row > start_row or finished:
+            self.active[command_id] = end_row
+            self.emit('output', command_id, text, start_row, end_row, finished)
+
+    def read(self, start_row):
+        """Returns the text of complete rows from start_row on, and the row to continue from"""
+
+        column, end_row = self.terminal.get_cursor_position()
+        end_row = max(start_row, end_row)
+
+        lines = [text for row, text in self.terminal.get_rows_text(start_row, end_row)]
+        return ''.join(line + '\n' for line in lines), end_row
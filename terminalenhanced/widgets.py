@@ -1,8 +1,18 @@
 import os
-import re
-
-from gi.repository import GObject, GLib, Gio, Pango, Gdk, Gtk, Gedit, Vte
-from .settings import Settings
+import bisect
+
+from gi.repository import GObject, GLib, Gio, Gdk, Gtk, Gedit, Vte
+from .settings import Settings, ProfileSettings
+from .pool import ShellPool
+from .statcache import StatCache
+from .outputindex import OutputIndex
+from .scrollback import ScrollbackSpill
+from .feeder import FeedQueue
+from .commands import CommandQueue
+from .streaming import OutputStreamer
+from .search import TerminalSearch
+from .matchers import MatcherRegistry
+from .stats import timed, start_timer
 
 from .workarounds import vte_terminal_event_check_regex_simple
 
@@ -22,29 +32,50 @@ class GeditTerminal(Vte.Terminal):
     }
 
     TARGET_URI_LIST = 200
-    XTRA_SCROLL_LINES = 2
-
-    VTE_REGEX_FLAGS =  0x400
-
-    #HIGHLIGHT_REGEX_STR = r'''([^:(),"'\s]*?[/.][^:(),"'\s]*)(:\d+)?:?'''
-    HIGHLIGHT_REGEX_STR = r'''^([^:(),"'\s]*?[/.][^:(),"'\s]*)(:\d+)?:?'''
-    CLICK_REGEX_STR = r'''([^:(),"'\s]+)(?::(\d+))?:?'''
-
-    HIGHLIGHT_VREGEX = Vte.Regex.new_for_match(HIGHLIGHT_REGEX_STR, len(HIGHLIGHT_REGEX_STR), VTE_REGEX_FLAGS)
-    CLICK_VREGEX = Vte.Regex.new_for_match(CLICK_REGEX_STR, len(CLICK_REGEX_STR), VTE_REGEX_FLAGS)
-    CLICK_PATTERN = re.compile(CLICK_REGEX_STR)
+    SPAWN_FLAGS = GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD
+    # part of the remaining distance scrolled per frame when scrolling smoothly
+    SMOOTH_SCROLL_FACTOR = 0.35
+
+    # what needs to be reapplied when a profile key changes
+    KEY_APPLIERS = {
+        'font'                  : 'apply_font',
+        'use-system-font'       : 'apply_font',
+        'monospace-font-name'   : 'apply_font',
+        'use-theme-colors'      : 'apply_colors',
+        'foreground-color'      : 'apply_colors',
+        'background-color'      : 'apply_colors',
+        'palette'               : 'apply_colors',
+        'cursor-blink-mode'     : 'apply_cursor',
+        'cursor-shape'          : 'apply_cursor',
+        'scroll-on-keystroke'   : 'apply_scrolling',
+        'scroll-on-output'      : 'apply_scrolling',
+        'scrollback-lines'      : 'apply_scrolling',
+        'scrollback-unlimited'  : 'apply_scrolling',
+        'allow-bold'            : 'apply_allow_bold',
+    }
 
     __gsignals__ = {
         "file-clicked": (
             GObject.SignalFlags.RUN_LAST,
             None,
-            (GObject.TYPE_STRING,GObject.TYPE_INT,)
-        )
+            (GObject.TYPE_STRING,GObject.TYPE_STRING,GObject.TYPE_INT,GObject.TYPE_INT,)
+        ),
+        "uri-clicked": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_STRING,)
+        ),
     }
 
-    def __init__(self):
+    def __init__(self, stats=None):
         Vte.Terminal.__init__(self)
 
+        self.stats = stats
+        self.spawn_started = None
+
+        # the GeditTerminalTab showing us, set by the tab
+        self.tab = None
+
         self.set_size(self.get_column_count(), 7)
         self.set_size_request(200, 130)
 
@@ -55,164 +86,682 @@ class GeditTerminal(Vte.Terminal):
                            [], Gdk.DragAction.DEFAULT | Gdk.DragAction.COPY)
         self.drag_dest_set_target_list(tl)
 
-        self.profile_settings = self.get_profile_settings()
-        self.profile_settings.connect("changed", self.on_profile_settings_changed)
-        self.system_settings = Gio.Settings.new("org.gnome.desktop.interface")
-        self.system_settings.connect("changed::monospace-font-name", self.font_changed)
+        self.profile_settings = ProfileSettings.get_default()
+        self.profile_handler_id = self.profile_settings.connect("changed", self.on_profile_settings_changed)
+        self.connect("destroy", self.on_destroy)
 
         self.reconfigure_vte()
 
-        result, pid = self.spawn_sync(Vte.PtyFlags.DEFAULT, None, [Vte.get_user_shell()], None, GLib.SpawnFlags.SEARCH_PATH, None, None, None)
-        self.child_pid = pid
-        self.match_add_regex(self.HIGHLIGHT_VREGEX, 0)
+        self.child_pid = None
+
+        # directories reported by the shell (OSC 7) and the first row each applies to
+        self.cwd = None
+        self.cwd_rows = []
+        self.cwd_dirs = []
+        self.connect('current-directory-uri-changed', self.on_cwd_changed)
+
+        self.output_index = OutputIndex(self)
+        self.scrollback = ScrollbackSpill(self)
+        self.feeder = FeedQueue(self)
+        self.commands = CommandQueue(self)
+        self.streamer = OutputStreamer(self)
+        self.search = TerminalSearch(self)
+
+        # OSC 8 links already know the absolute file, no guessing needed
+        self.set_allow_hyperlink(True)
+
+        self.matchers = MatcherRegistry.get_default()
+        self.matchers_handler_id = self.matchers.connect('changed', self.on_matchers_changed)
+        self.highlight_tags = [self.match_add_regex(vregex, 0) for vregex in self.matchers.highlight_regexes]
+        self.hover_cell = None
+        self.motion_handler_id = 0
+
+        self.settings = Settings.get_shared()
+        self.settings_handler_id = self.settings.connect('changed::highlight-existing-files-only',
+                                                         lambda s, k: self.apply_highlight_mode())
+        self.apply_highlight_mode()
+
         self.connect("button-press-event", self.on_button_press)
         self.connect('text-scrolled', self.on_text_scroll)
 
+        self.scroll_pending = 0
+        self.scroll_tick_id = 0
+        self.scrolling = False
 
-    def do_drag_data_received(self, drag_context, x, y, data, info, time):
-        if info == self.TARGET_URI_LIST:
-            self.feed_child(' '.join(["'" + Gio.file_new_for_uri(item).get_path() + "'" for item in Gedit.utils_drop_get_uris(data)]).encode('utf-8'))
-            Gtk.drag_finish(drag_context, True, False, time);
+
+    def start_shell(self, pool=None, cwd=None):
+        # adopting an already running shell is instant, otherwise we spawn one
+        # asynchronously so that the main loop isn't blocked by the shell startup.
+        # pooled shells are in our directory, so they can't be used for another one
+        shell = pool.take() if pool and cwd is None else None
+        self.spawn_started = start_timer()
+
+        if shell:
+            pty, pid = shell
+            self.set_pty(pty)
+            self.watch_child(pid)
+            self.child_pid = pid
+            self.feeder.resume()
+
+            if self.stats:
+                self.stats.since('spawn', self.spawn_started)
         else:
-            Vte.Terminal.do_drag_data_received(self, drag_context, x, y, data, info, time)
+            self.spawn_async(Vte.PtyFlags.DEFAULT, cwd, [Vte.get_user_shell()], None, self.SPAWN_FLAGS,
+                             None, None, -1, None, self.on_shell_spawned, None)
 
-    def settings_try_new(self, schema):
-        schemas = Gio.Settings.list_schemas()
-        if not schemas:
-            return None
+    def restart_shell(self, pool=None):
+        """Starts a new shell after the previous one has exited, keeping the widget"""
 
-        for s in schemas:
-            if s == schema:
-                return Gio.Settings.new(schema)
+        keep_scrollback = self.settings.get_boolean('keep-scrollback-on-restart')
 
-        return None
+        # the old shell may have left any modes set, the screen goes to the scrollback
+        self.reset(True, not keep_scrollback)
 
-    def get_profile_settings(self):
-        profiles = self.settings_try_new("org.gnome.Terminal.ProfilesList")
+        if not keep_scrollback:
+            self.cwd_rows.clear()
+            self.cwd_dirs.clear()
+            self.scrollback.discard()
 
-        if profiles:
-            default_path = "/org/gnome/terminal/legacy/profiles:/:" + profiles.get_string("default") + "/"
-            settings = Gio.Settings.new_with_path("org.gnome.Terminal.Legacy.Profile",
-                                                  default_path)
-        else:
-            settings = Settings.get("profile")
+        self.feeder.cancel()
+        self.child_pid = None
+        self.cwd = None
 
-        return settings
+        self.start_shell(pool)
 
-    def get_font(self):
-        if self.profile_settings.get_boolean("use-system-font"):
-            font = self.system_settings.get_string("monospace-font-name")
-        else:
-            font = self.profile_settings.get_string("font")
+    def on_shell_spawned(self, term, pid, error, user_data):
+        if error is None:
+            self.child_pid = pid
+            self.feeder.resume()
 
-        return font
+            if self.stats:
+                self.stats.since('spawn', self.spawn_started)
 
-    def font_changed(self, settings=None, key=None):
-        font = self.get_font()
-        font_desc = Pango.font_description_from_string(font)
+    def do_drag_data_received(self, drag_context, x, y, data, info, time):
+        if info == self.TARGET_URI_LIST:
+            # one piece per file, these are written in chunks if there's a lot of them
+            paths = ["'" + Gio.file_new_for_uri(item).get_path() + "'" for item in Gedit.utils_drop_get_uris(data)]
+            self.feeder.push([path if idx == 0 else ' ' + path for idx, path in enumerate(paths)])
+            Gtk.drag_finish(drag_context, True, False, time);
+        else:
+            Vte.Terminal.do_drag_data_received(self, drag_context, x, y, data, info, time)
 
-        self.set_font(font_desc)
+    def on_destroy(self, widget):
+        self.profile_settings.disconnect(self.profile_handler_id)
+        self.settings.disconnect(self.settings_handler_id)
+        self.matchers.disconnect(self.matchers_handler_id)
 
+    @timed('reconfigure')
     def reconfigure_vte(self):
-        # Fonts
-        self.font_changed()
+        self.apply_font()
+        self.apply_colors()
+        self.apply_cursor()
+        self.apply_scrolling()
+
+        self.apply_allow_bold()
+        self.set_audible_bell(self.defaults['audible_bell'])
+
+    def apply_font(self):
+        self.set_font(self.profile_settings.get_font_desc())
+
+    def apply_colors(self):
+        fg, bg = self.profile_settings.get_colors()
 
-        # colors
         context = self.get_style_context()
-        fg = context.get_color(Gtk.StateFlags.NORMAL)
-        bg = context.get_background_color(Gtk.StateFlags.NORMAL)
-        palette = []
-
-        if not self.profile_settings.get_boolean("use-theme-colors"):
-            fg_color = self.profile_settings.get_string("foreground-color")
-            if fg_color != "":
-                fg = Gdk.RGBA()
-                parsed = fg.parse(fg_color)
-            bg_color = self.profile_settings.get_string("background-color")
-            if bg_color != "":
-                bg = Gdk.RGBA()
-                parsed = bg.parse(bg_color)
-        str_colors = self.profile_settings.get_strv("palette")
-        if str_colors:
-            for str_color in str_colors:
-                try:
-                    rgba = Gdk.RGBA()
-                    rgba.parse(str_color)
-                    palette.append(rgba)
-                except:
-                    palette = []
-                    break
-
-        self.set_colors(fg, bg, palette)
+        if fg is None:
+            fg = context.get_color(Gtk.StateFlags.NORMAL)
+        if bg is None:
+            bg = context.get_background_color(Gtk.StateFlags.NORMAL)
+
+        self.set_colors(fg, bg, self.profile_settings.get_palette())
+
+    def apply_cursor(self):
         self.set_cursor_blink_mode(self.profile_settings.get_enum("cursor-blink-mode"))
         self.set_cursor_shape(self.profile_settings.get_enum("cursor-shape"))
-        self.set_audible_bell(self.profile_settings.get_boolean("audible-bell"))
-        self.set_allow_bold(self.profile_settings.get_boolean("allow-bold"))
+
+    def apply_scrolling(self):
         self.set_scroll_on_keystroke(self.profile_settings.get_boolean("scroll-on-keystroke"))
         self.set_scroll_on_output(self.profile_settings.get_boolean("scroll-on-output"))
-        self.set_audible_bell(self.defaults['audible_bell'])
+        self.set_scrollback_lines(self.profile_settings.get_scrollback_lines())
+
+    def apply_allow_bold(self):
+        self.set_allow_bold(self.profile_settings.get_boolean("allow-bold"))
+
+    def on_profile_settings_changed(self, settings, keys):
+        if keys is None:
+            self.reconfigure_vte()
+            return
 
-        if self.profile_settings.get_boolean("scrollback-unlimited"):
-            lines = -1
+        # keys we don't use (gnome-terminal profiles have plenty) are ignored
+        appliers = set(self.KEY_APPLIERS[key] for key in keys if key in self.KEY_APPLIERS)
+
+        for applier in appliers:
+            getattr(self, applier)()
+
+    def on_cwd_changed(self, term):
+        uri = self.get_current_directory_uri()
+        path = Gio.File.new_for_uri(uri).get_path() if uri else None
+
+        if not path or path == self.cwd:
+            return
+
+        self.cwd = path
+
+        # output printed from now on comes from the new directory
+        column, row = self.get_cursor_position()
+        if self.cwd_rows and self.cwd_rows[-1] >= row:
+            self.cwd_rows[-1] = row
+            self.cwd_dirs[-1] = path
         else:
-            lines = self.profile_settings.get_int("scrollback-lines")
-        self.set_scrollback_lines(lines)
+            self.cwd_rows.append(row)
+            self.cwd_dirs.append(path)
 
-    def on_profile_settings_changed(self, settings, key):
-        self.reconfigure_vte()
+        # forget directories of rows that are no longer in the scrollback
+        first_row = self.get_vadjustment().get_lower()
+        while len(self.cwd_rows) > 1 and self.cwd_rows[1] <= first_row:
+            del self.cwd_rows[0]
+            del self.cwd_dirs[0]
+
+    def get_event_row(self, event):
+        return int(self.get_vadjustment().get_value()) + int(event.y // self.get_char_height())
+
+    def get_cwd(self, row=None):
+        """Returns the directory the shell was in when the given row was printed"""
+
+        if row is not None:
+            idx = bisect.bisect_right(self.cwd_rows, row) - 1
+            if idx >= 0:
+                return self.cwd_dirs[idx]
+        elif self.cwd is not None:
+            return self.cwd
+
+        # the shell doesn't report its directory or the row is older than that
+        if self.child_pid is None:
+            # the shell is still starting, it inherits our cwd
+            return os.getcwd()
 
-    def get_cwd(self):
         return os.readlink('/proc/%s/cwd' % self.child_pid)
 
+    def get_rows_text(self, start_row, end_row):
+        """Returns a list of (row, text) for rows in [start_row, end_row)"""
+
+        if end_row <= start_row:
+            return []
+
+        # every row ends with a newline, so n rows give n + 1 pieces, the last one empty
+        lines = self.get_text_rows(start_row, end_row - 1).split('\n')
+
+        if len(lines) == end_row - start_row + 1 and not lines[-1]:
+            return list(enumerate(lines[:-1], start_row))
+
+        # wrapped lines don't end with a newline, so rows have to be fetched one by one
+        return [(row, self.get_text_rows(row, row).rstrip('\n')) for row in range(start_row, end_row)]
+
+    def get_text_rows(self, start_row, end_row):
+        if hasattr(self, 'get_text_range_format'):
+            text, length = self.get_text_range_format(Vte.Format.TEXT, start_row, 0, end_row, self.get_column_count())
+        else:
+            text, attributes = self.get_text_range(start_row, 0, end_row, self.get_column_count(), None, None)
+
+        return text or ''
+
+    def get_visible_rows(self):
+        first_row = int(self.get_vadjustment().get_value())
+        return first_row, first_row + self.get_row_count()
+
+    def get_results(self, start_row, end_row):
+        """Returns (row, name, line, column) for each row in [start_row, end_row)
+        with a reference to a line, like grep -n or compiler output"""
+
+        results = []
+
+        for row, text in self.get_rows_text(start_row, end_row):
+            reference = self.matchers.search(text)
+            if reference and reference[1]:
+                results.append((row,) + reference)
+
+        return results
+
+    @timed('click')
     def on_button_press(self, term, event):
         if event.button == 1 and (event.state & Gdk.ModifierType.CONTROL_MASK):
-            # event_check_regex_simple can't currently be called via pygobject, so we use a workaround
-            has_match, matches = vte_terminal_event_check_regex_simple(self, event, [self.CLICK_VREGEX], 0)
+            uri = self.hyperlink_check_event(event)
+            if uri:
+                self.open_hyperlink(uri)
+                return True
 
-            if has_match:
-                match = self.CLICK_PATTERN.match(matches[0])
+            # event_check_regex_simple can't currently be called via pygobject, so we use a workaround.
+            # one call checks all matchers, the first one that matched wins
+            has_match, matches = vte_terminal_event_check_regex_simple(self, event, self.matchers.regexes, 0)
+            result = self.matchers.get_match(matches) if has_match else None
 
-                filename = os.path.join(self.get_cwd(), match.group(1))
-                line = int(match.group(2) or 0)
+            if result:
+                matcher, (name, line, column) = result
+
+                if matcher.is_url:
+                    self.emit("uri-clicked", name)
+                else:
+                    cwd = self.get_cwd(self.get_event_row(event))
+                    self.emit("file-clicked", cwd, name, line, column)
 
-                self.emit("file-clicked", filename, line)
                 return True
 
         return False
 
+    def open_hyperlink(self, uri):
+        scheme = GLib.uri_parse_scheme(uri)
+
+        if scheme != 'file':
+            self.emit("uri-clicked", uri)
+            return
+
+        uri, sep, fragment = uri.partition('#')
+        try:
+            path, hostname = GLib.filename_from_uri(uri)
+        except GLib.Error:
+            return
+
+        if hostname and hostname not in ('localhost', GLib.get_host_name()):
+            # can't open a file on some other machine
+            return
+
+        # some tools put the line number in the fragment
+        line = int(fragment) if fragment.isdigit() else 0
+        self.emit("file-clicked", os.path.dirname(path), os.path.basename(path), line, 0)
+
+    def apply_highlight_mode(self):
+        validate = self.settings.get_boolean('highlight-existing-files-only')
+
+        if validate and not self.motion_handler_id:
+            self.motion_handler_id = self.connect('motion-notify-event', self.on_motion)
+            self.set_highlight_enabled(False)
+        elif not validate and self.motion_handler_id:
+            self.disconnect(self.motion_handler_id)
+            self.motion_handler_id = 0
+            self.set_highlight_enabled(True)
+
+        self.hover_cell = None
+
+    def set_highlight_enabled(self, enabled):
+        if enabled and not self.highlight_tags:
+            self.highlight_tags = [self.match_add_regex(vregex, 0) for vregex in self.matchers.highlight_regexes]
+        elif not enabled and self.highlight_tags:
+            for tag in self.highlight_tags:
+                self.match_remove(tag)
+            self.highlight_tags = []
+
+    def on_matchers_changed(self, matchers):
+        if self.highlight_tags:
+            self.set_highlight_enabled(False)
+            self.set_highlight_enabled(True)
+
+        self.hover_cell = None
+
+    def on_motion(self, term, event):
+        # we run before VTE updates the hovered match, so the highlight regex is only
+        # present when the name under the pointer is known to exist
+        cell = (int(event.x // self.get_char_width()), self.get_event_row(event))
+        if cell == self.hover_cell:
+            return False
+
+        self.hover_cell = cell
+        exists = False
+
+        has_match, matches = vte_terminal_event_check_regex_simple(self, event, self.matchers.highlight_regexes, 0)
+        result = self.matchers.get_match(matches, True) if has_match else None
+
+        if result and result[0].is_url:
+            exists = True
+        elif result:
+            name = result[1][0]
+            result = StatCache.get_default().check(self.get_cwd(cell[1]), name,
+                                                   lambda exists, is_dir: self.on_hover_checked(cell, exists))
+            exists = result is not None and result[0]
+
+        self.set_highlight_enabled(exists)
+        return False
+
+    def on_hover_checked(self, cell, exists):
+        if cell == self.hover_cell:
+            self.set_highlight_enabled(exists)
+
     def on_text_scroll(self, term, delta):
-      if delta in (-1, 1):
-         vadj = self.get_vadjustment()
-         vadj.set_value(vadj.get_value() + delta*self.XTRA_SCROLL_LINES*vadj.get_step_increment())
+        # fast wheels and touchpads send many events per frame, so we only collect
+        # the distance here and scroll once per frame
+        # our own scrolling is reported too, it mustn't scroll any further
+        if delta in (-1, 1) and not self.scrolling:
+            self.scroll_pending += delta * self.settings.get_double('scroll-multiplier')
+
+            if not self.scroll_tick_id:
+                self.scroll_tick_id = self.add_tick_callback(self.on_scroll_tick)
+
+    def on_scroll_tick(self, widget, frame_clock):
+        if self.settings.get_boolean('smooth-scrolling'):
+            # slow down as we get closer, but move at least a line per frame
+            lines = min(max(abs(self.scroll_pending) * self.SMOOTH_SCROLL_FACTOR, 1), abs(self.scroll_pending))
+            lines = lines if self.scroll_pending > 0 else -lines
+        else:
+            lines = self.scroll_pending
+
+        self.scroll_pending -= lines
+
+        vadj = self.get_vadjustment()
+        self.scrolling = True
+        try:
+            vadj.set_value(vadj.get_value() + lines*vadj.get_step_increment())
+        finally:
+            self.scrolling = False
+
+        if abs(self.scroll_pending) < 0.01:
+            self.scroll_pending = 0
+            self.scroll_tick_id = 0
+            return GLib.SOURCE_REMOVE
+
+        return GLib.SOURCE_CONTINUE
+
+class GeditTerminalTab(Gtk.Box):
+    """Notebook page with a terminal, its scrollbar and the progress of sending large inputs"""
+
+    # smaller inputs are sent quickly, showing the progress would only flicker
+    PROGRESS_THRESHOLD = 256 * 1024
+
+    def __init__(self, terminal, close_callback):
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
+
+        self.terminal = terminal
+        self.suspend_id = 0
+
+        # the terminal is inside an inner box, its parent isn't the page
+        terminal.tab = self
+
+        box = Gtk.Box()
+        box.pack_start(terminal, True, True, 0)
+
+        scrollbar = Gtk.Scrollbar.new(Gtk.Orientation.VERTICAL, terminal.get_vadjustment())
+        scrollbar.show()
+        box.pack_start(scrollbar, False, False, 0)
+        box.show()
+        self.pack_start(box, True, True, 0)
+
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_valign(Gtk.Align.CENTER)
+
+        cancel_button = Gtk.Button.new_from_icon_name('process-stop-symbolic', Gtk.IconSize.MENU)
+        cancel_button.set_relief(Gtk.ReliefStyle.NONE)
+        cancel_button.set_tooltip_text(_("Cancel sending input"))
+        cancel_button.connect('clicked', lambda b: terminal.feeder.cancel())
+
+        self.progress = Gtk.Box(spacing=6)
+        self.progress.pack_start(self.progress_bar, True, True, 0)
+        self.progress.pack_start(cancel_button, False, False, 0)
+        self.progress.set_no_show_all(True)
+        self.progress_bar.show()
+        cancel_button.show()
+        self.pack_start(self.progress, False, False, 0)
+
+        terminal.feeder.connect('progress', self.on_feed_progress)
+        terminal.feeder.connect('finished', lambda feeder, cancelled: self.progress.hide())
+
+        self.label = Gtk.Box(spacing=4)
+        self.title = Gtk.Label(label=_("Terminal"))
+        self.label.pack_start(self.title, True, True, 0)
+
+        button = Gtk.Button.new_from_icon_name('window-close-symbolic', Gtk.IconSize.MENU)
+        button.set_relief(Gtk.ReliefStyle.NONE)
+        button.set_focus_on_click(False)
+        button.connect('clicked', lambda b: close_callback(self))
+        self.label.pack_start(button, False, False, 0)
+        self.label.show_all()
+
+        terminal.connect('window-title-changed', self.on_title_changed)
+        self.connect('destroy', lambda w: self.cancel_suspend())
+
+    def on_feed_progress(self, feeder, written, total):
+        if total < self.PROGRESS_THRESHOLD:
+            return
+
+        self.progress_bar.set_fraction(written / total)
+        self.progress_bar.set_text(_("Sending input: %d of %d KiB") % (written // 1024, total // 1024))
+        self.progress.show()
+
+    def on_title_changed(self, term):
+        self.title.set_text(term.get_window_title() or _("Terminal"))
+
+    def schedule_suspend(self):
+        timeout = Settings.get_shared().get_int('suspend-hidden-tabs-after')
+
+        if timeout and not self.suspend_id:
+            self.suspend_id = GLib.timeout_add_seconds(timeout, self.suspend)
+
+    def cancel_suspend(self):
+        if self.suspend_id:
+            GLib.source_remove(self.suspend_id)
+            self.suspend_id = 0
+
+    def suspend(self):
+        self.suspend_id = 0
+
+        # nobody has looked at it for a while, the scrollback can go to disk
+        self.terminal.scrollback.spill(0)
+        return GLib.SOURCE_REMOVE
+
 
 class GeditTerminalEnhancedPanel(Gtk.Box):
     """VTE terminal which follows gnome-terminal default profile options"""
 
+    # Vte.Terminal shortcuts that global shortcuts should not override
+    VTE_SHORTCUTS = frozenset(
+        [(Gdk.keyval_from_name(c), int(Gdk.ModifierType.CONTROL_MASK)) for c in 'acdehklrtuwz'] +
+        [(Gdk.keyval_from_name(c), int(Gdk.ModifierType.MOD1_MASK)) for c in 'bf']
+    )
+
     def __init__(self, plugin):
         Gtk.Box.__init__(self)
 
         self.plugin = plugin
+        self.current_tab = None
+
+        self.notebook = Gtk.Notebook()
+        self.notebook.set_show_border(False)
+        self.notebook.set_show_tabs(False)
+        self.notebook.set_scrollable(True)
+        self.notebook.connect('switch-page', self.on_switch_page)
+        self.notebook.show()
+
+        self.create_search_bar()
+
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+        self.pack_start(self.search_bar, False, False, 0)
+        self.pack_start(self.notebook, True, True, 0)
+
+        self.accel_table = None
+        self.keys_changed_id = self.plugin.window.connect('keys-changed', self.on_window_keys_changed)
+        self.connect('destroy', self.on_destroy)
 
-        self.add_terminal()
         self.create_action_group()
         self.create_popup_menu()
 
+        if Settings.get_shared().get_boolean('lazy-terminal'):
+            # until then we're just an empty notebook
+            self.map_handler_id = self.connect('map', self.on_map)
+        else:
+            self.add_terminal()
+
+    def on_map(self, widget):
+        self.disconnect(self.map_handler_id)
+        self.ensure_terminal()
 
-    def add_terminal(self):
-        self._vte = GeditTerminal()
-        self._vte.show()
-        self.pack_start(self._vte, True, True, 0)
+    @property
+    def _vte(self):
+        """Terminal of the current tab"""
 
-        self._vte.connect("child-exited", self.on_vte_child_exited)
-        self._vte.connect("key-press-event", self.on_vte_key_press)
-        self._vte.connect("button-press-event", self.on_vte_button_press)
-        self._vte.connect("popup-menu", self.on_vte_popup_menu)
-        self._vte.connect("file-clicked", self.on_vte_file_clicked)
-        self._vte.connect("focus-in-event", self.on_vte_focus)
+        return self.current_tab.terminal if self.current_tab else None
 
-        scrollbar = Gtk.Scrollbar.new(Gtk.Orientation.VERTICAL, self._vte.get_vadjustment())
-        scrollbar.show()
-        self.pack_start(scrollbar, False, False, 0)
+    def ensure_terminal(self):
+        if self._vte is None:
+            self.add_terminal()
+
+        return self._vte
+
+    def add_terminal(self, position=-1):
+        term = GeditTerminal(self.stats)
+
+        # the first terminal of a window continues where the last session ended
+        session = self.plugin.session
+        if not session or not session.restore(term):
+            term.start_shell(ShellPool.get_default())
+        term.show()
+
+        term.connect("child-exited", self.on_vte_child_exited)
+        term.connect("key-press-event", self.on_vte_key_press)
+        term.connect("button-press-event", self.on_vte_button_press)
+        term.connect("popup-menu", self.on_vte_popup_menu)
+        term.connect("file-clicked", self.on_vte_file_clicked)
+        term.connect("uri-clicked", self.on_vte_uri_clicked)
+        term.connect("current-directory-uri-changed", self.on_vte_cwd_changed)
+        term.connect("focus-in-event", self.on_vte_focus)
+        term.commands.connect("command-finished", self.on_vte_command_finished)
+        term.streamer.connect("output", self.on_vte_output)
+
+        tab = GeditTerminalTab(term, self.close_tab)
+        tab.show()
+
+        position = self.notebook.insert_page(tab, tab.label, position)
+        self.notebook.set_tab_reorderable(tab, True)
+        self.notebook.set_current_page(position)
+        self.notebook.set_show_tabs(self.notebook.get_n_pages() > 1)
+
+        return term
+
+    def close_tab(self, tab):
+        position = self.notebook.page_num(tab)
+        if position < 0:
+            return
+
+        if tab is self.current_tab:
+            self.current_tab = None
+
+        self.notebook.remove_page(position)
+        tab.destroy()
+
+        if self.notebook.get_n_pages() == 0:
+            # there's always a terminal, once it was needed
+            self.add_terminal()
+        else:
+            self.notebook.set_show_tabs(self.notebook.get_n_pages() > 1)
+
+    def on_switch_page(self, notebook, tab, position):
+        # tabs that aren't visible aren't drawn, but they keep their scrollback
+        # in memory, which may be moved to disk after a while
+        if self.current_tab is not None and self.current_tab is not tab:
+            self.current_tab.schedule_suspend()
+
+        tab.cancel_suspend()
+
+        # the search follows the visible terminal
+        if self.search_bar.get_search_mode() and self.current_tab is not tab:
+            if self.current_tab is not None:
+                self.current_tab.terminal.search.clear()
+
+            self.current_tab = tab
+            self.on_search_changed()
+
+        self.current_tab = tab
+
+    def create_search_bar(self):
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_width_chars(30)
+        self.search_entry.connect('search-changed', self.on_search_changed)
+        self.search_entry.connect('activate', lambda e: self.find(True))
+        self.search_entry.connect('next-match', lambda e: self.find(True))
+        self.search_entry.connect('previous-match', lambda e: self.find(False))
+        self.search_entry.connect('stop-search', lambda e: self.close_search())
+
+        previous_button = Gtk.Button.new_from_icon_name('go-up-symbolic', Gtk.IconSize.BUTTON)
+        previous_button.connect('clicked', lambda b: self.find(False))
+        next_button = Gtk.Button.new_from_icon_name('go-down-symbolic', Gtk.IconSize.BUTTON)
+        next_button.connect('clicked', lambda b: self.find(True))
+
+        buttons = Gtk.Box()
+        buttons.get_style_context().add_class('linked')
+        buttons.pack_start(previous_button, False, False, 0)
+        buttons.pack_start(next_button, False, False, 0)
+
+        self.search_regex = Gtk.CheckButton.new_with_mnemonic(_("Regular e_xpression"))
+        self.search_regex.connect('toggled', self.on_search_changed)
+        self.search_case = Gtk.CheckButton.new_with_mnemonic(_("_Match case"))
+        self.search_case.connect('toggled', self.on_search_changed)
+
+        self.search_count = Gtk.Label()
+        self.search_count.get_style_context().add_class('dim-label')
+
+        box = Gtk.Box(spacing=6)
+        box.pack_start(self.search_entry, False, False, 0)
+        box.pack_start(buttons, False, False, 0)
+        box.pack_start(self.search_regex, False, False, 0)
+        box.pack_start(self.search_case, False, False, 0)
+        box.pack_start(self.search_count, False, False, 0)
+
+        self.search_bar = Gtk.SearchBar()
+        self.search_bar.set_show_close_button(True)
+        self.search_bar.add(box)
+        self.search_bar.connect_entry(self.search_entry)
+        self.search_bar.connect('notify::search-mode-enabled', self.on_search_mode_changed)
+        self.search_bar.show_all()
+
+        self.search_handler = None
+
+    def show_search(self, *args):
+        self.ensure_terminal()
+        self.search_bar.set_search_mode(True)
+        self.search_entry.grab_focus()
+        return True
+
+    def close_search(self):
+        self.search_bar.set_search_mode(False)
+
+        if self._vte:
+            self._vte.grab_focus()
+
+    def on_search_mode_changed(self, search_bar, pspec):
+        if not search_bar.get_search_mode():
+            if self.search_handler:
+                self.search_handler[0].disconnect(self.search_handler[1])
+                self.search_handler = None
+
+            if self._vte:
+                self._vte.search.clear()
+
+    def on_search_changed(self, *args):
+        search = self._vte.search
+
+        if self.search_handler and self.search_handler[0] is not search:
+            self.search_handler[0].disconnect(self.search_handler[1])
+            self.search_handler = None
+
+        if not self.search_handler:
+            self.search_handler = (search, search.connect('counted', self.on_search_counted))
+
+        self.search_count.set_text('')
+        valid = search.set_text(self.search_entry.get_text(),
+                                self.search_regex.get_active(), self.search_case.get_active())
+
+        if valid:
+            self.search_entry.get_style_context().remove_class('error')
+        else:
+            self.search_entry.get_style_context().add_class('error')
+
+    def on_search_counted(self, search, count, complete):
+        if count < 0:
+            self.search_count.set_text('')
+        elif complete:
+            self.search_count.set_text(_("%d matches") % count)
+        else:
+            self.search_count.set_text(_("%d matches so far") % count)
+
+    def find(self, forward):
+        if self._vte:
+            self._vte.search.find(forward)
 
     def create_action_group(self):
         self.action_group = Gio.SimpleActionGroup()
@@ -223,6 +772,14 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
             ('copy-clipboard', self.copy_clipboard),
             ('paste-clipboard', self.paste_clipboard),
             ('paste-current-file', self.paste_current_file),
+            ('open-all-matches', self.open_all_matches),
+            ('next-result', self.next_result),
+            ('previous-result', self.previous_result),
+            ('open-earlier-output', self.open_earlier_output),
+            ('cancel-feed', self.cancel_feed),
+            ('new-tab', self.new_tab),
+            ('close-tab', self.close_current_tab),
+            ('find', self.show_search),
         )
 
         for name, callback in actions:
@@ -239,13 +796,24 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
         section.append(_("C_hange Directory"), "term.change-directory")
         model.append_section(None, section)
 
+        section = Gio.Menu()
+        section.append(_("New _Tab"), "term.new-tab")
+        section.append(_("C_lose Tab"), "term.close-tab")
+        model.append_section(None, section)
+
         section = Gio.Menu()
         section.append(_("_Copy"), "term.copy-clipboard")
         section.append(_("_Paste"), "term.paste-clipboard")
+        section.append(_("_Find…"), "term.find")
+        section.append(_("Cancel _sending input"), "term.cancel-feed")
         model.append_section(None, section)
 
         section = Gio.Menu()
         section.append(_("Paste current f_ile"), "term.paste-current-file")
+        section.append(_("_Open all matches"), "term.open-all-matches")
+        section.append(_("_Next result"), "term.next-result")
+        section.append(_("Pre_vious result"), "term.previous-result")
+        section.append(_("Open _earlier output"), "term.open-earlier-output")
         model.append_section(None, section)
 
         self.menu = Gtk.Menu.new_from_model(model)
@@ -267,6 +835,8 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
             self.actions['change-directory'].set_enabled(directory is not None)
             self.actions['copy-clipboard'].set_enabled(self._vte.get_has_selection())
             self.actions['paste-current-file'].set_enabled(path is not None)
+            self.actions['open-earlier-output'].set_enabled(self._vte.scrollback.has_spilled())
+            self.actions['cancel-feed'].set_enabled(self._vte.feeder.is_busy())
 
     def show_popup(self, event = None):
         self.update_action_state()
@@ -281,9 +851,23 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
             self.menu.select_first(False)
 
     def feed_string(self, string):
-        self._vte.feed_child(string.encode('utf-8'))
+        self.ensure_terminal()
+        self._vte.feeder.push(string)
         self._vte.grab_focus()
 
+    def run_commands(self, commands):
+        return self.ensure_terminal().commands.push(commands)
+
+    def subscribe_output(self, command):
+        term = self.ensure_terminal()
+        command_id, = term.commands.push([command])
+        term.streamer.subscribe(command_id)
+        return command_id
+
+    def read_output(self, cursor):
+        term = self.ensure_terminal()
+        return term.streamer.read(max(cursor, int(term.get_vadjustment().get_lower())))
+
     def feed_path(self, path):
         self.feed_string("'" + path + "'")
 
@@ -292,8 +876,13 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
         self.feed_string('cd "%s"\n' % path)
 
     def do_grab_focus(self):
-        self._vte.grab_focus()
+        self.ensure_terminal().grab_focus()
+
+    @property
+    def stats(self):
+        return self.plugin.stats
 
+    @timed('key-press')
     def on_vte_key_press(self, term, event):
         # gedit overrides the default GtkWindow event handling mechanism, so we get events
         # before accelerators which 'd normally not be the case
@@ -320,36 +909,62 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
         if event.keyval == Gdk.KEY_Delete:
             return False
 
-        if modifiers & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK):
-            keyval_name = Gdk.keyval_name(Gdk.keyval_to_upper(event.keyval))
+        key = (Gdk.keyval_to_lower(event.keyval), int(modifiers))
+        if key in self.VTE_SHORTCUTS:
+            return False
 
-            if modifiers == Gdk.ModifierType.CONTROL_MASK and keyval_name in 'ACDEHKLRTUWZ':
-                return False
+        accel_table = self.get_accel_table()
 
-            if modifiers == Gdk.ModifierType.MOD1_MASK and keyval_name in 'BF':
+        if key not in accel_table:
+            # plain typing, no need to ask anyone else
+            if not modifiers & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK):
                 return False
-
+        elif accel_table[key] is not None:
             # very ugly hack: handle our accelerators manually
             # it must be done, because it's not that actions in our namespace are checked
             # first, so other plugins' accelerators override our terminal-local ones
-
-            accel = Gtk.accelerator_name(event.keyval, modifiers)
-            actions = self.get_toplevel().get_application().get_actions_for_accel(accel)
-
-            for action in actions:
-                if action.startswith('term.'):
-                    self.actions[action[len('term.'):]].activate()
-                    return True
+            self.actions[accel_table[key]].activate()
+            return True
 
         # now we'll give other accelerators a chance, to reverse gedit's behaviour
         return self.get_toplevel().activate_key(event)
 
-    def on_vte_child_exited(self, term, status):
-        for child in self.get_children():
-            child.destroy()
+    def get_accel_table(self):
+        """Maps (keyval, modifiers) of every application accelerator to our action name,
+        or to None if it belongs to some other action"""
 
-        self.add_terminal()
-        self._vte.grab_focus()
+        if self.accel_table is None:
+            self.accel_table = {}
+            app = self.plugin.window.get_application()
+
+            for action in app.list_action_descriptions():
+                for accel in app.get_accels_for_action(action):
+                    keyval, modifiers = Gtk.accelerator_parse(accel)
+                    if not keyval:
+                        continue
+
+                    key = (Gdk.keyval_to_lower(keyval), int(modifiers))
+                    if action.startswith('term.'):
+                        self.accel_table[key] = action[len('term.'):]
+                    else:
+                        self.accel_table.setdefault(key, None)
+
+        return self.accel_table
+
+    def on_window_keys_changed(self, window):
+        # accelerators changed, rebuild the table when it's needed again
+        self.accel_table = None
+
+    def on_destroy(self, widget):
+        self.plugin.window.disconnect(self.keys_changed_id)
+
+    def on_vte_child_exited(self, term, status):
+        if self.notebook.get_n_pages() > 1:
+            self.close_tab(term.tab)
+            self._vte.grab_focus()
+        else:
+            # the last one stays, with a new shell
+            term.restart_shell(ShellPool.get_default())
 
     def on_vte_focus(self, term, arg):
         # re-enable all keys, we could also do this on keypress
@@ -358,12 +973,25 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
     def on_vte_popup_menu(self, term):
         self.show_popup()
 
-    def on_vte_file_clicked(self, term, filename, line):
-        self.plugin.open_file(filename, line)
+    def on_vte_command_finished(self, commands, command_id, command, status, duration):
+        self.plugin.on_command_finished(command_id, command, status, duration)
+
+    def on_vte_output(self, streamer, command_id, text, start_row, end_row, finished):
+        self.plugin.on_command_output(command_id, text, start_row, end_row, finished)
+
+    def on_vte_file_clicked(self, term, cwd, name, line, column):
+        self.plugin.open_file(cwd, name, line, column)
+
+    def on_vte_cwd_changed(self, term):
+        # the index is ready by the time something is clicked
+        self.plugin.prepare_project_index(term.cwd)
+
+    def on_vte_uri_clicked(self, term, uri):
+        Gtk.show_uri_on_window(self.plugin.window, uri, Gtk.get_current_event_time())
 
     def on_vte_button_press(self, term, event):
         if event.button == 3:
-            self._vte.grab_focus()
+            term.grab_focus()
             self.show_popup(event)
             return True
 
@@ -393,4 +1021,60 @@ class GeditTerminalEnhancedPanel(Gtk.Box):
             self.feed_path(path)
         return True
 
+    def open_all_matches(self, *args):
+        files = []
+        seen = set()
+
+        for row, name, line, column in self._vte.get_results(*self._vte.get_visible_rows()):
+            cwd = self._vte.get_cwd(row)
+            path = os.path.normpath(os.path.join(cwd, name))
+
+            # the first match in each file wins
+            if path not in seen:
+                seen.add(path)
+                files.append((cwd, name, line, column))
+
+        self.plugin.open_files(files)
+        return True
+
+    def next_result(self, *args):
+        self.goto_result(True)
+        return True
+
+    def previous_result(self, *args):
+        self.goto_result(False)
+        return True
+
+    def goto_result(self, forward):
+        term = self.ensure_terminal()
+        first_row, end_row = term.get_visible_rows()
 
+        row = term.output_index.step(forward, first_row - 1 if forward else end_row)
+        if row is None:
+            return
+
+        if not first_row <= row < end_row:
+            # scroll it into the middle of the view
+            term.get_vadjustment().set_value(max(0, row - (end_row - first_row) // 2))
+
+        for row, name, line, column in term.get_results(row, row + 1):
+            self.plugin.open_file(term.get_cwd(row), name, line, column)
+
+    def open_earlier_output(self, *args):
+        if self._vte.scrollback.has_spilled():
+            self.plugin.load_file(self._vte.scrollback.path, 0)
+        return True
+
+    def cancel_feed(self, *args):
+        self._vte.feeder.cancel()
+        return True
+
+    def new_tab(self, *args):
+        self.add_terminal(self.notebook.get_current_page() + 1).grab_focus()
+        return True
+
+    def close_current_tab(self, *args):
+        if self.current_tab:
+            self.close_tab(self.current_tab)
+            self._vte.grab_focus()
+        return True
@@ -1,30 +1,144 @@
+import os
+import json
 import ctypes
 import ctypes.util
 
-vte = ctypes.cdll.LoadLibrary(ctypes.util.find_library("vte-2.91"))
-glib = ctypes.cdll.LoadLibrary(ctypes.util.find_library("glib-2.0"))
-glib.g_free.restype = None
+from gi.repository import GLib
+
+SONAME_CACHE_PATH = os.path.join(GLib.get_user_cache_dir(), 'gedit-terminal-enhanced', 'sonames.json')
+
+
+class NativeLibrary:
+    """Shared library loaded on first use
+
+    Resolving a library with ctypes.util.find_library spawns ldconfig/gcc, so
+    we first try the usual soname and then the one remembered from the last
+    run, and only fall back to find_library if neither loads."""
+
+    def __init__(self, name, soname, functions):
+        self.name = name
+        self.soname = soname
+        self.functions = functions
+        self.lib = None
+
+    def __getattr__(self, attr):
+        if self.lib is None:
+            self.lib = self.load()
+
+        return getattr(self.lib, attr)
+
+    def load(self):
+        cache = load_soname_cache()
+        candidates = [self.soname]
+
+        if cache.get(self.name) not in (None, self.soname):
+            candidates.append(cache[self.name])
+
+        for soname in candidates:
+            try:
+                lib = ctypes.CDLL(soname)
+                break
+            except OSError:
+                pass
+        else:
+            soname = ctypes.util.find_library(self.name)
+            lib = ctypes.CDLL(soname)
+
+            cache[self.name] = soname
+            save_soname_cache(cache)
+
+        for func, (restype, argtypes) in self.functions.items():
+            getattr(lib, func).restype = restype
+            getattr(lib, func).argtypes = argtypes
+
+        return lib
+
+
+def load_soname_cache():
+    try:
+        with open(SONAME_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_soname_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(SONAME_CACHE_PATH), exist_ok=True)
+        with open(SONAME_CACHE_PATH, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+
+vte = NativeLibrary('vte-2.91', 'libvte-2.91.so.0', {
+    'vte_terminal_event_check_regex_simple': (ctypes.c_int, [
+        ctypes.c_void_p,                    # VteTerminal *terminal
+        ctypes.c_void_p,                    # GdkEvent *event
+        ctypes.POINTER(ctypes.c_void_p),    # VteRegex **regexes
+        ctypes.c_size_t,                    # gsize n_regexes
+        ctypes.c_uint32,                    # guint32 match_flags
+        ctypes.POINTER(ctypes.c_void_p),    # char **matches
+    ]),
+})
+
+glib = NativeLibrary('glib-2.0', 'libglib-2.0.so.0', {
+    'g_free': (None, [ctypes.c_void_p]),
+})
+
+ctypes.pythonapi.PyCapsule_GetPointer.restype = ctypes.c_void_p
+ctypes.pythonapi.PyCapsule_GetPointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
 
 
 def gobject_addr(obj):
-    return int(str(obj).split(" at ")[-1].split(')')[0], 16)
+    """Returns the address of the C object wrapped by a PyGObject wrapper"""
+
+    try:
+        return ctypes.pythonapi.PyCapsule_GetPointer(obj.__gpointer__, None)
+    except AttributeError:
+        # boxed types have no __gpointer__, but PyGObject hashes them by address
+        return hash(obj)
+
+
+# arrays for the regex sets we've seen, the click regexes don't change so
+# there's no need to build them again on every click
+regex_arrays = {}
+match_arrays = {}
+
+
+def get_regex_array(regexes):
+    key = tuple(id(regex) for regex in regexes)
+
+    if key not in regex_arrays:
+        if len(regex_arrays) >= 16:
+            regex_arrays.clear()
+
+        # keep the regexes referenced, so that the ids stay valid
+        c_regexes = (ctypes.c_void_p * len(regexes))(*[gobject_addr(regex) for regex in regexes])
+        regex_arrays[key] = (c_regexes, tuple(regexes))
+
+    return regex_arrays[key][0]
+
+
+def get_match_array(n_regexes):
+    if n_regexes not in match_arrays:
+        match_arrays[n_regexes] = (ctypes.c_void_p * n_regexes)()
+
+    return match_arrays[n_regexes]
 
 
 def vte_terminal_event_check_regex_simple(terminal, event, regexes, flags):
     n_regexes = len(regexes)
 
-    c_regexes = (ctypes.c_void_p * n_regexes)()
-    for idx, regex in enumerate(regexes):
-        c_regexes[idx] = gobject_addr(regex)
-
-    c_matches = (ctypes.c_void_p * 1)()
+    c_regexes = get_regex_array(regexes)
+    c_matches = get_match_array(n_regexes)
 
     has_matches = vte.vte_terminal_event_check_regex_simple(
-        ctypes.c_void_p(gobject_addr(terminal)),
-        ctypes.c_void_p(gobject_addr(event)),
+        gobject_addr(terminal),
+        gobject_addr(event),
         c_regexes,
-        ctypes.c_size_t(n_regexes),
-        ctypes.c_uint32(flags),
+        n_regexes,
+        flags,
         c_matches,
     )
 
@@ -36,6 +150,7 @@ def vte_terminal_event_check_regex_simple(terminal, event, regexes, flags):
 
             matches[idx] = match.decode()
 
-            glib.g_free(ctypes.c_void_p(match_ptr))
+            glib.g_free(match_ptr)
+            c_matches[idx] = None
 
     return has_matches, matches